@@ -78,11 +78,39 @@ WSGI_APPLICATION = 'django_app.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# SQLite is used by default. Set DATABASE_ENGINE=postgresql and the DATABASE_NAME, DATABASE_USER,
+# DATABASE_PASSWORD, DATABASE_HOST and DATABASE_PORT environment variables to use PostgreSQL instead.
+if os.environ.get('DATABASE_ENGINE') == 'postgresql':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('DATABASE_NAME', 'webble'),
+            'USER': os.environ.get('DATABASE_USER', ''),
+            'PASSWORD': os.environ.get('DATABASE_PASSWORD', ''),
+            'HOST': os.environ.get('DATABASE_HOST', ''),
+            'PORT': os.environ.get('DATABASE_PORT', ''),
+            'CONN_MAX_AGE': int(os.environ.get('DATABASE_CONN_MAX_AGE', 60)),
+            'CONN_HEALTH_CHECKS': True,
+        }
     }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+            'CONN_MAX_AGE': int(os.environ.get('DATABASE_CONN_MAX_AGE', 60)),
+        }
+    }
+
+# PRAGMAs run on every new SQLite connection. WAL lets readers work alongside a writer, writers wait for
+# the lock for busy_timeout milliseconds instead of failing with "database is locked".
+SQLITE_PRAGMAS = {
+    'busy_timeout': 20000,
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -20000,
+    'temp_store': 'MEMORY',
 }
 
 
@@ -126,6 +154,97 @@ STATICFILES_DIRS = [os.path.join(BASE_DIR, 'static')]
 MEDIA_URL = 'media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Rendered book pages are cached on disk and in a size bounded in-memory LRU
+PAGE_CACHE_DIR = MEDIA_ROOT / 'page_cache'
+PAGE_CACHE_MEMORY_BYTES = 64 * 1024 * 1024
+# Page image URLs carry a version token, so clients may keep them for a long time
+PAGE_IMAGE_MAX_AGE = 60 * 60 * 24 * 365
+
+# Book pages are rendered with one of these profiles, selected with the ?profile= query parameter of the reader.
+# Unknown names are rejected, so every page is rendered and cached in a bounded number of variants.
+# dpi is the render resolution, format one of jpeg, webp or png, grayscale drops the colours of text-only pages
+# and clip keeps the (x0, y0, x1, y1) fraction of the page, e.g. to cut the margins on small screens.
+PAGE_RENDER_PROFILES = {
+    'standard': {'dpi': 72, 'format': 'jpeg', 'quality': 90},
+    'hidpi': {'dpi': 144, 'format': 'webp', 'quality': 80},
+    'phone': {'dpi': 110, 'format': 'webp', 'quality': 70, 'clip': (0.06, 0.04, 0.94, 0.96)},
+    'text': {'dpi': 96, 'format': 'png', 'grayscale': True},
+    'saver': {'dpi': 60, 'format': 'jpeg', 'quality': 60, 'grayscale': True},
+}
+PAGE_DEFAULT_PROFILE = 'standard'
+# In the text reading mode pages whose images cover this share of the page are shown rendered
+READER_IMAGE_PAGE_COVERAGE = 0.5
+
+# Covers and portraits are stored resized to these widths as WebP and JPEG, named after their content hash
+IMAGE_VARIANT_DIR = 'variants'
+IMAGE_VARIANT_WIDTHS = (160, 320, 640)
+IMAGE_VARIANT_QUALITY = 80
+
+# Open PDF documents are pooled per process, bounded by count and total file size
+DOCUMENT_POOL_SIZE = 16
+DOCUMENT_POOL_MAX_BYTES = 512 * 1024 * 1024
+
+# Pages after the one being read are rendered ahead on a background thread pool
+PAGE_PREFETCH_DEPTH = 3
+PAGE_PREFETCH_WORKERS = 2
+PAGE_PREFETCH_MAX_PENDING = 8
+
+# Set READER_ASYNC=1 when serving the app with an ASGI server, the reader and page images are then served by
+# async views. They render pages on PAGE_RENDER_WORKERS threads with at most PAGE_RENDER_MAX_PENDING pages
+# waiting, further page image requests are refused with 503.
+READER_ASYNC = os.environ.get('READER_ASYNC') == '1'
+PAGE_RENDER_WORKERS = 4
+PAGE_RENDER_MAX_PENDING = 32
+
+# New authors and books are enriched by the ingest_worker command, retried with exponential backoff.
+# Set INGEST_ASYNC to False to process them right after the saving transaction commits instead.
+INGEST_ASYNC = True
+INGEST_MAX_ATTEMPTS = 5
+INGEST_RETRY_DELAY = 30
+# Seconds a worker may hold a claimed job before other workers consider it dead and claim the job again
+INGEST_LEASE = 15 * 60
+
+# Wiki API client used to enrich authors and books. Responses are cached on disk for WIKI_CACHE_TTL seconds
+# in the git ignored cache directory, set WIKI_CACHE_PATH to None to disable the cache.
+WIKI_API_URL = 'https://en.wikipedia.org/w/api.php'
+WIKI_TIMEOUT = (3.05, 10)
+WIKI_MAX_RETRIES = 3
+WIKI_RETRY_BACKOFF = 0.5
+WIKI_POOL_SIZE = 10
+WIKI_CACHE_PATH = BASE_DIR / 'cache' / 'wiki_cache.sqlite3'
+WIKI_CACHE_TTL = 60 * 60 * 24 * 30
+
+# Reading progress is buffered per process and written in batches of PROGRESS_FLUSH_SIZE entries
+# and by a background thread every PROGRESS_FLUSH_INTERVAL seconds.
+# PROGRESS_KNOWN_ROWS bounds the remembered existing rows.
+PROGRESS_FLUSH_SIZE = 100
+PROGRESS_FLUSH_INTERVAL = 10
+PROGRESS_KNOWN_ROWS = 100000
+
+# Django's cache holds the navbar genres, anonymous catalogue pages and template fragments, invalidated through
+# versions stored in the cache itself. Deployments running several processes need a shared cache, set REDIS_URL.
+if os.environ.get('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['REDIS_URL'],
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+RESPONSE_CACHE_TIMEOUT = 60 * 10
+FRAGMENT_CACHE_TIMEOUT = 60 * 60
+# Rows per page of the JSON API, by default and at most
+API_PAGE_SIZE = 50
+API_MAX_PAGE_SIZE = 200
+
+# Row counts shown next to the keyset paginated lists are reused for this many seconds
+ESTIMATED_COUNT_TIMEOUT = 60 * 10
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
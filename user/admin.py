@@ -6,6 +6,9 @@ class BookmarkAdmin(admin.ModelAdmin):
     list_display = ('book_title', 'user_username', 'date', 'page')
     search_fields = ('book__title', 'user__username', 'date')
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).with_related()
+
     def book_title(self, obj):
         return obj.book.title
     book_title.short_description = 'Book Title'
@@ -19,6 +22,9 @@ class ReviewAdmin(admin.ModelAdmin):
     list_display = ('book_title', 'user_username', 'date', 'rating', 'review')
     search_fields = ('book__title', 'user__username',)
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).with_related()
+
     def book_title(self, obj):
         return obj.book.title
     book_title.short_description = 'Book Title'
@@ -32,6 +38,9 @@ class ReadingProgressAdmin(admin.ModelAdmin):
     list_display = ('book_title', 'user_username', 'date_started', 'date_finished', 'last_page_read')
     search_fields = ('book__title', 'user__username',)
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).with_related()
+
     def book_title(self, obj):
         return obj.book.title
     book_title.short_description = 'Book Title'
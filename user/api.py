@@ -0,0 +1,64 @@
+from django.contrib.auth.mixins import LoginRequiredMixin
+
+from webble.methods.api import ApiView
+from .methods.progress import progress_tracker
+from .models import Review, ReadingProgress, Bookmark
+
+
+class ReviewApiView(ApiView):
+    """
+    Reviews of all books, or of one book with ?book=<pk>.
+    """
+    model = Review
+    cache_scopes = ('ratings',)
+    api_fields = {
+        'id': lambda review: review.pk,
+        'book': lambda review: review.book_id,
+        'user': lambda review: review.user.username,
+        'date': lambda review: review.date,
+        'rating': lambda review: review.rating,
+        'review': lambda review: review.review,
+    }
+    api_select = {'user': ('user',)}
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.request.GET.get('book', '').isdigit():
+            queryset = queryset.filter(book_id=self.request.GET['book'])
+        return queryset
+
+
+class ProgressApiView(LoginRequiredMixin, ApiView):
+    """
+    Reading progress of the logged-in user.
+    """
+    raise_exception = True
+    model = ReadingProgress
+    api_fields = {
+        'id': lambda progress: progress.pk,
+        'book': lambda progress: progress.book_id,
+        'last_page_read': lambda progress: progress.last_page_read,
+        'date_started': lambda progress: progress.date_started,
+        'date_finished': lambda progress: progress.date_finished,
+    }
+
+    def get_queryset(self):
+        progress_tracker.flush()
+        return super().get_queryset().filter(user=self.request.user)
+
+
+class BookmarkApiView(LoginRequiredMixin, ApiView):
+    """
+    Bookmarks of the logged-in user.
+    """
+    raise_exception = True
+    model = Bookmark
+    api_fields = {
+        'id': lambda bookmark: bookmark.pk,
+        'book': lambda bookmark: bookmark.book_id,
+        'page': lambda bookmark: bookmark.page,
+        'date': lambda bookmark: bookmark.date,
+    }
+
+    def get_queryset(self):
+        return super().get_queryset().filter(user=self.request.user)
@@ -1,6 +1,10 @@
+from django.utils.functional import SimpleLazyObject
+
+
 # Check if the user logged in is a Staff member.
 # Used to display add book and author choices in base.html when logged in.
+# Evaluated lazily, so templates that don't check it don't load the user.
 def staff_status(request):
     return {
-        'is_staff': request.user.is_staff
+        'is_staff': SimpleLazyObject(lambda: request.user.is_staff)
     }
@@ -1,27 +1,74 @@
-from django.core.exceptions import ObjectDoesNotExist
-from django.utils import timezone
+from functools import reduce
+from operator import or_
 
-from user.models import ReadingProgress, Review
+from django.db.models import F, Q
+
+from user.methods.progress import progress_tracker
+from user.models import Bookmark, ReadingProgress, Review
+from webble.models import Book
 
 
 def update_reading_progress(user, book, current_page):
     """
     This function updates the reader's progress once the ReadBook view is accessed.
+    Page turns are buffered by the progress tracker and written in batches.
+
+    :param user: User object
+    :param book: Book object
+    :param current_page: Current page number
+    """
+    progress_tracker.record(user, book, current_page)
+
+
+async def aupdate_reading_progress(user, book, current_page):
+    """
+    Async version of update_reading_progress, used by the async ReadBook view.
 
     :param user: User object
     :param book: Book object
     :param current_page: Current page number
     """
-    try:
-        reading_progress = ReadingProgress.objects.get(user=user, book=book)
-        if reading_progress.book.page_count >= current_page > reading_progress.last_page_read:
-            if current_page == reading_progress.book.page_count:
-                reading_progress.date_finished = timezone.now()
-            reading_progress.last_page_read = current_page
-            reading_progress.save()
-    except ObjectDoesNotExist:
-        reading_progress = ReadingProgress.objects.create(user=user, book=book, last_page_read=current_page)
-        reading_progress.save()
+    await progress_tracker.arecord(user, book, current_page)
+
+
+def add_bookmarks(user, book, pages):
+    """
+    This function bookmarks several pages of a book at once.
+    Already bookmarked pages are skipped by the unique constraint of the bookmarks.
+
+    :param user: User object
+    :param book: Book object
+    :param pages: Page numbers
+    :return: Set of the newly bookmarked page numbers
+    """
+    existing = set(Bookmark.objects.filter(user=user, book=book, page__in=pages).values_list('page', flat=True))
+    Bookmark.objects.bulk_create([Bookmark(user=user, book=book, page=page) for page in pages], ignore_conflicts=True)
+    return set(pages) - existing
+
+
+def delete_bookmarks(user, book_pages):
+    """
+    This function deletes several bookmarks of the user with one query.
+
+    :param user: User object
+    :param book_pages: List of (book primary key, page number) tuples
+    :return: Number of deleted bookmarks
+    """
+    if not book_pages:
+        return 0
+    matching = reduce(or_, (Q(book_id=book_pk, page=page) for book_pk, page in book_pages))
+    return Bookmark.objects.filter(matching, user=user).delete()[0]
+
+
+def delete_progress(user, progress_pks):
+    """
+    This function deletes several reading progress entries of the user.
+
+    :param user: User object
+    :param progress_pks: Primary keys of the progress entries
+    :return: Number of deleted entries
+    """
+    return ReadingProgress.objects.filter(user=user, pk__in=progress_pks).delete()[0]
 
 
 def get_review(user, book_pk):
@@ -35,3 +82,23 @@ def get_review(user, book_pk):
     """
     if Review.objects.filter(user=user, book=book_pk).exists():
         return Review.objects.get(user=user, book=book_pk)
+
+
+def update_book_rating(book_pk, added=None, removed=None):
+    """
+    This function keeps the rating aggregates of a book in step with its reviews.
+    The aggregates are changed with a single UPDATE relative to the stored values,
+    so it should run in the same transaction as the review change.
+
+    :param book_pk: Book primary key
+    :param added: Rating of a created or updated review
+    :param removed: Rating of a deleted review or the previous rating of an updated review
+    """
+    changes = {}
+    for rating, step in ((added, 1), (removed, -1)):
+        if rating is None:
+            continue
+        for field, value in (('rating_sum', rating * step), ('rating_count', step), (f'rating_count_{rating}', step)):
+            changes[field] = changes.get(field, 0) + value
+    if changes:
+        Book.objects.filter(pk=book_pk).update(**{field: F(field) + value for field, value in changes.items()})
@@ -0,0 +1,153 @@
+import atexit
+import logging
+import threading
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from user.models import ReadingProgress
+
+logger = logging.getLogger(__name__)
+
+
+class ProgressTracker:
+    """
+    Write-coalescing tracker of the last page read per user and book.
+
+    Page turns only update an in-memory buffer holding the furthest page per (user, book).
+    The buffer is written in one transaction once it holds PROGRESS_FLUSH_SIZE entries, and by a background
+    thread every PROGRESS_FLUSH_INTERVAL seconds, with conditional UPDATEs that never move progress back,
+    so several processes can flush the same rows safely. Rows deleted by another process are recreated.
+    Finishing a book is written straight away and the buffer is flushed when the process exits.
+    """
+
+    def __init__(self):
+        self._pending = {}
+        self._known = set()
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+        self._timer = None
+
+    def record(self, user, book, page):
+        """
+        Record that the user has read the page of the book.
+        The progress row is created on the first page read, later pages are buffered.
+
+        :param user: User object
+        :param book: Book object
+        :param page: Current page number
+        """
+        key = (user.pk, book.pk)
+        if key not in self._known:
+            _, created = ReadingProgress.objects.get_or_create(user=user, book=book, defaults={'last_page_read': page})
+            if self._remember(key, created, book, page):
+                return
+        if self._buffer(key, book, page):
+            self.flush()
+
+    async def arecord(self, user, book, page):
+        """
+        Async version of record for the async reader view, the progress row is created with the async ORM.
+
+        :param user: User object
+        :param book: Book object
+        :param page: Current page number
+        """
+        key = (user.pk, book.pk)
+        if key not in self._known:
+            _, created = await ReadingProgress.objects.aget_or_create(user=user, book=book,
+                                                                      defaults={'last_page_read': page})
+            if self._remember(key, created, book, page):
+                return
+        if self._buffer(key, book, page):
+            await sync_to_async(self.flush)()
+
+    def _remember(self, key, created, book, page):
+        """
+        Remember that the progress row exists.
+
+        :return: True if the row was just created with the page, so there is nothing to buffer
+        """
+        with self._lock:
+            if len(self._known) >= settings.PROGRESS_KNOWN_ROWS:
+                self._known.clear()
+            self._known.add(key)
+        return created and page != book.page_count
+
+    def _buffer(self, key, book, page):
+        """
+        Buffer the page if it is further than the buffered one.
+
+        :return: True if the buffer is due to be flushed
+        """
+        if book.page_count is None or page > book.page_count:
+            return False
+        finished = page == book.page_count
+        with self._lock:
+            if page <= self._pending.get(key, (0, False))[0]:
+                return False
+            self._pending[key] = (page, finished)
+            if self._timer is None:
+                self._timer = threading.Thread(target=self._flush_periodically, name='progress-flush', daemon=True)
+                self._timer.start()
+            return (finished or len(self._pending) >= settings.PROGRESS_FLUSH_SIZE
+                    or time.monotonic() - self._last_flush >= settings.PROGRESS_FLUSH_INTERVAL)
+
+    def flush(self):
+        """
+        Write the buffered progress to the database.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._last_flush = time.monotonic()
+        if not pending:
+            return
+        try:
+            with transaction.atomic():
+                for (user_pk, book_pk), (page, finished) in pending.items():
+                    changes = {'last_page_read': page}
+                    if finished:
+                        changes['date_finished'] = timezone.now()
+                    if not ReadingProgress.objects.filter(user_id=user_pk, book_id=book_pk,
+                                                          last_page_read__lt=page).update(**changes):
+                        # The row may have been deleted by another process, which can't make this one forget it
+                        ReadingProgress.objects.get_or_create(user_id=user_pk, book_id=book_pk, defaults=changes)
+        except Exception:
+            with self._lock:
+                for key, entry in pending.items():
+                    if entry[0] > self._pending.get(key, (0, False))[0]:
+                        self._pending[key] = entry
+            raise
+
+    def _flush_periodically(self):
+        """
+        Flush the buffer every PROGRESS_FLUSH_INTERVAL seconds, so progress is written even when no further
+        page is read in this process.
+        """
+        while True:
+            time.sleep(settings.PROGRESS_FLUSH_INTERVAL)
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Flushing reading progress failed')
+            finally:
+                connection.close()
+
+    def forget(self, user_pk, book_pk):
+        """
+        Drop the buffered progress of a deleted progress row, so reading the book again recreates it.
+        Only the process handling the delete forgets it, the others recreate the row when they flush.
+
+        :param user_pk: User primary key
+        :param book_pk: Book primary key
+        """
+        with self._lock:
+            self._pending.pop((user_pk, book_pk), None)
+            self._known.discard((user_pk, book_pk))
+
+
+progress_tracker = ProgressTracker()
+atexit.register(progress_tracker.flush)
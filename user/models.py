@@ -6,15 +6,31 @@ from django.utils import timezone
 from webble.models import Book
 
 
+class UserBookQuerySet(models.QuerySet):
+    """
+    Queryset of rows linking a user and a book, loading the related objects in the same query.
+    """
+
+    def with_book(self):
+        return self.select_related('book')
+
+    def with_related(self):
+        return self.select_related('book', 'user')
+
+
 class Bookmark(models.Model):
     book = models.ForeignKey(Book, on_delete=models.CASCADE)
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     date = models.DateField(auto_now_add=True)
     page = models.IntegerField(null=True, blank=True)
 
+    objects = UserBookQuerySet.as_manager()
+
     class Meta:
         ordering = ['date']
         unique_together = ('book', 'user', 'page',)
+        # Bookmarks are listed per user by date, the unique index serves (user, book, page) lookups
+        indexes = [models.Index(fields=['user', 'date'], name='user_bookmark_user_date_idx')]
 
 
 class Review(models.Model):
@@ -24,9 +40,14 @@ class Review(models.Model):
     rating = models.IntegerField(validators=[MinValueValidator(1), MaxValueValidator(5)])
     review = models.TextField(max_length=150)
 
+    objects = UserBookQuerySet.as_manager()
+
     class Meta:
         ordering = ['date']
         unique_together = ('book', 'user',)
+        # Reviews are listed per book by date on the book page and per user by date
+        indexes = [models.Index(fields=['book', 'date'], name='user_review_book_date_idx'),
+                   models.Index(fields=['user', 'date'], name='user_review_user_date_idx')]
 
 
 class ReadingProgress(models.Model):
@@ -36,5 +57,7 @@ class ReadingProgress(models.Model):
     date_finished = models.DateField(null=True, blank=True)
     last_page_read = models.IntegerField(null=True, blank=True)
 
+    objects = UserBookQuerySet.as_manager()
+
     class Meta:
-        unique_together = ('book', 'user', 'last_page_read')
+        unique_together = ('book', 'user',)
@@ -0,0 +1,11 @@
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+from .methods.progress import progress_tracker
+from .models import ReadingProgress
+
+
+# Deleted progress has to be recreated when the book is read again.
+@receiver(post_delete, sender=ReadingProgress)
+def progress_deleted(sender, instance, **kwargs):
+    progress_tracker.forget(instance.user_id, instance.book_id)
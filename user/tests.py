@@ -1,3 +1,179 @@
-from django.test import TestCase
+import threading
+from io import StringIO
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+
+from user.methods.helper import add_bookmarks, delete_bookmarks, delete_progress
+from user.methods.progress import ProgressTracker
+from user.models import Bookmark, ReadingProgress, Review
+from webble.models import Book, Author, Genre
+from webble.testing import QueryPlanMixin
+
+
+class QueryCountTests(TestCase):
+    """
+    Pins the number of queries per view, so it doesn't grow with the number of rows shown.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_superuser('reader', 'reader@example.com', 'password')
+        self.client.force_login(self.user)
+        self.authors = Author.objects.bulk_create([Author(name=f'Author {number}') for number in range(3)])
+        self.genres = Genre.objects.bulk_create([Genre(genre=f'Genre {number}') for number in range(3)])
+
+    def create_books(self, count):
+        books = Book.objects.bulk_create([Book(title=f'Book {number}', pdf='books/book.pdf',
+                                               cover_image='covers/not_found.jpg') for number in range(count)])
+        for book in books:
+            book.authors.set(self.authors)
+            book.genres.set(self.genres)
+        return books
+
+    def create_reading_data(self, count):
+        books = self.create_books(count)
+        Bookmark.objects.bulk_create([Bookmark(book=book, user=self.user, page=page)
+                                      for book in books for page in (1, 2)])
+        ReadingProgress.objects.bulk_create([ReadingProgress(book=book, user=self.user, last_page_read=1)
+                                             for book in books])
+        return books
+
+    def test_user_details_queries_do_not_grow_with_bookmarks(self):
+        self.create_reading_data(20)
+        with self.assertNumQueries(6):
+            response = self.client.get(f'/user/{self.user.username}/')
+        self.assertEqual(len(response.context['user_bookmarks']), 20)
+
+    def test_batch_operations_do_not_grow_with_selection(self):
+        books = self.create_reading_data(20)
+        with self.assertNumQueries(2):
+            self.assertEqual(add_bookmarks(self.user, books[0], [1, 2, 3, 4]), {3, 4})
+        with self.assertNumQueries(1):
+            self.assertEqual(delete_bookmarks(self.user, [(book.pk, 1) for book in books]), 20)
+        with self.assertNumQueries(2):
+            self.assertEqual(delete_progress(self.user, ReadingProgress.objects.values_list('pk', flat=True)), 20)
+        self.assertEqual(Bookmark.objects.count(), 22)
+
+    def test_book_detail_queries_do_not_grow_with_reviews(self):
+        book = self.create_books(1)[0]
+        reviewers = User.objects.bulk_create([User(username=f'reviewer{number}') for number in range(10)])
+        Review.objects.bulk_create([Review(book=book, user=reviewer, rating=4, review='Good')
+                                    for reviewer in reviewers])
+        with self.assertNumQueries(10):
+            response = self.client.get(f'/book/{book.pk}/')
+        self.assertContains(response, 'reviewer9')
+
+    def test_book_admin_queries_do_not_grow_with_books(self):
+        self.create_books(20)
+        with self.assertNumQueries(8):
+            self.client.get('/admin/webble/book/')
+
+    def test_bookmark_admin_queries_do_not_grow_with_bookmarks(self):
+        self.create_reading_data(20)
+        with self.assertNumQueries(6):
+            self.client.get('/admin/user/bookmark/')
+
+
+class RatingAggregateTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('reader')
+        self.client.force_login(self.user)
+        self.book = Book.objects.create(title='Dune', pdf='books/dune.pdf', cover_image='covers/not_found.jpg')
+
+    def aggregates(self):
+        self.book.refresh_from_db()
+        return self.book.rating_sum, self.book.rating_count, [reviews for _, reviews in self.book.rating_histogram]
+
+    def test_reviews_keep_aggregates_in_step(self):
+        self.client.post(f'/book/{self.book.pk}/review/add', {'rating': 4, 'review': 'Spice'})
+        self.assertEqual(self.aggregates(), (4, 1, [0, 1, 0, 0, 0]))
+        review = Review.objects.get()
+        self.client.post(f'/book/{self.book.pk}/rev_edit/{review.pk}', {'rating': 2, 'review': 'Sand'})
+        self.assertEqual(self.aggregates(), (2, 1, [0, 0, 0, 1, 0]))
+        self.client.post(f'/book/{self.book.pk}/rev_delete/{review.pk}')
+        self.assertEqual(self.aggregates(), (0, 0, [0, 0, 0, 0, 0]))
+
+    def test_repair_recomputes_aggregates_from_reviews(self):
+        Review.objects.create(book=self.book, user=self.user, rating=5, review='Spice')
+        Review.objects.create(book=self.book, user=User.objects.create_user('other'), rating=3, review='Sand')
+        Book.objects.filter(pk=self.book.pk).update(rating_sum=99, rating_count_1=7)
+        call_command('repair_ratings', stdout=StringIO())
+        self.assertEqual(self.aggregates(), (8, 2, [1, 0, 1, 0, 0]))
+
+    def test_histogram_is_shown_on_book_page(self):
+        self.client.post(f'/book/{self.book.pk}/review/add', {'rating': 4, 'review': 'Spice'})
+        response = self.client.get(f'/book/{self.book.pk}/')
+        self.assertContains(response, '4&#9733; 1')
+        self.assertContains(response, '5&#9733; 0')
+
+
+class ReadingQueryPlanTests(QueryPlanMixin, TestCase):
+    """
+    Checks that the user page and book page lookups seek an index and read the rows in date order.
+    """
+
+    def test_user_bookmarks_use_user_date_index(self):
+        self.assertUsesIndex(Bookmark.objects.filter(user_id=1), 'user_bookmark_user_date_idx')
+
+    def test_bookmark_lookup_uses_unique_index(self):
+        self.assertUsesIndex(Bookmark.objects.filter(user_id=1, book_id=1, page=1))
+
+    def test_book_reviews_use_book_date_index(self):
+        self.assertUsesIndex(Review.objects.filter(book_id=1), 'user_review_book_date_idx')
+
+    def test_user_reviews_use_user_date_index(self):
+        self.assertUsesIndex(Review.objects.filter(user_id=1), 'user_review_user_date_idx')
+
+    def test_progress_lookup_uses_unique_index(self):
+        self.assertUsesIndex(ReadingProgress.objects.filter(user_id=1, book_id=1))
+
+
+class ApiTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('reader', password='password')
+        book = Book.objects.create(title='Dune', pdf='books/dune.pdf')
+        Bookmark.objects.create(book=book, user=self.user, page=3)
+        Bookmark.objects.create(book=book, user=User.objects.create_user('other'), page=4)
+
+    def test_bookmarks_of_the_logged_in_user(self):
+        self.client.force_login(self.user)
+        response = self.client.get('/api/bookmarks/?fields=page')
+        self.assertEqual(response.json()['results'], [{'page': 3}])
+        etag = response['ETag']
+        self.assertEqual(self.client.get('/api/bookmarks/?fields=page', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+    def test_anonymous_progress_is_forbidden(self):
+        self.assertEqual(self.client.get('/api/progress/').status_code, 403)
+
+
+class ProgressTrackerTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('reader')
+        self.book = Book.objects.create(title='Book', pdf='books/book.pdf', page_count=10)
+
+    def test_flush_recreates_progress_deleted_by_another_process(self):
+        tracker = ProgressTracker()
+        tracker.record(self.user, self.book, 1)
+        # Deleting makes the module tracker forget the row, this tracker plays another process that still knows it
+        ReadingProgress.objects.filter(user=self.user, book=self.book).delete()
+        tracker.record(self.user, self.book, 5)
+        tracker.flush()
+        self.assertEqual(ReadingProgress.objects.get(user=self.user, book=self.book).last_page_read, 5)
+
+    @override_settings(PROGRESS_FLUSH_INTERVAL=0.01)
+    def test_buffer_is_flushed_without_further_reading(self):
+        flushed = threading.Event()
+
+        class Tracker(ProgressTracker):
+            def flush(self):
+                if threading.current_thread().name == 'progress-flush':
+                    flushed.set()
+
+        tracker = Tracker()
+        tracker.record(self.user, self.book, 1)
+        tracker.record(self.user, self.book, 2)
+        self.assertTrue(flushed.wait(5))
@@ -1,7 +1,7 @@
 from django.urls import path
 from django.contrib.auth import views as auth_views
 
-from . import views
+from . import api, views
 
 app_name = 'user'
 
@@ -13,4 +13,7 @@ urlpatterns = [
     path('book/<int:pk>/review/add', views.CreateReview.as_view(), name='add_review'),
     path('book/<int:pk>/rev_edit/<int:review>', views.UpdateReview.as_view(), name='update_review'),
     path('book/<int:pk>/rev_delete/<int:review>', views.DeleteReview.as_view(), name='delete_review'),
+    path('api/reviews/', api.ReviewApiView.as_view(), name='api_reviews'),
+    path('api/progress/', api.ProgressApiView.as_view(), name='api_progress'),
+    path('api/bookmarks/', api.BookmarkApiView.as_view(), name='api_bookmarks'),
     ]
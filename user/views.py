@@ -1,9 +1,13 @@
 from django.contrib import messages
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib.auth.models import User
+from django.db import transaction
+from django.template.defaultfilters import pluralize
 from django.urls import reverse_lazy
 from django.views.generic import FormView, DetailView, CreateView, UpdateView, DeleteView
 
+from user.methods.helper import delete_bookmarks, delete_progress, update_book_rating
+from user.methods.progress import progress_tracker
 from user.models import ReadingProgress, Bookmark, Review
 from webble.forms import RegistrationForm
 from webble.models import Book
@@ -47,15 +51,16 @@ class UserDetails(DetailView):
         :return: Context dictionary.
         """
         context = super().get_context_data(**kwargs)
-        context['user_progress'] = ReadingProgress.objects.filter(user=self.object)
+        progress_tracker.flush()
+        context['user_progress'] = ReadingProgress.objects.filter(user=self.object).with_book()
 
         user_bookmarks = {}
-        for bookmark in Bookmark.objects.filter(user=self.object):
-            title = bookmark.book.title
+        for bookmark in Bookmark.objects.filter(user=self.object).with_book():
+            book = bookmark.book
             page_number = bookmark.page
-            if title not in user_bookmarks:
-                user_bookmarks[title] = []
-            user_bookmarks[title].append(page_number)
+            if book not in user_bookmarks:
+                user_bookmarks[book] = []
+            user_bookmarks[book].append(page_number)
 
         context['user_bookmarks'] = user_bookmarks
         return context
@@ -70,25 +75,31 @@ class UserDetails(DetailView):
         """
         if 'delete_bookmark' in request.POST:
             """
-            Since 2 items are passed, we split them to obtain the title and page separately.
-            We get the Bookmark object that matches the user, title and page. Then we delete.
+            Every selected bookmark passes 2 items, we split them to obtain the book primary key and page separately.
+            The selected bookmarks of the user are deleted with one query.
             """
-            title, page = request.POST['delete_bookmark'].split('|')
-            bookmark = Bookmark.objects.get(
-                user=self.request.user,
-                book__title=title,
-                page=page)
-            bookmark.delete()
-            messages.success(self.request, 'Bookmark deleted successfully')
+            try:
+                book_pages = []
+                for value in request.POST.getlist('delete_bookmark'):
+                    book_pk, page = value.split('|')
+                    book_pages.append((int(book_pk), int(page)))
+            except ValueError:
+                messages.error(self.request, 'Invalid bookmark')
+            else:
+                deleted = delete_bookmarks(self.request.user, book_pages)
+                messages.success(self.request, f'{deleted} bookmark{pluralize(deleted)} deleted successfully')
         if 'delete_progress' in request.POST:
             """
-            We filter by the request.user and primary key to obtain the specified entry. Then we delete.
+            The selected progress entries of the user are deleted with one query.
             """
-            progress = ReadingProgress.objects.get(
-                user=self.request.user,
-                pk=request.POST['delete_progress'])
-            progress.delete()
-            messages.success(self.request, 'Progress deleted successfully')
+            try:
+                progress_pks = [int(pk) for pk in request.POST.getlist('delete_progress')]
+            except ValueError:
+                messages.error(self.request, 'Invalid progress')
+            else:
+                deleted = delete_progress(self.request.user, progress_pks)
+                messages.success(self.request,
+                                 f'{deleted} progress entr{pluralize(deleted, "y,ies")} deleted successfully')
         return self.get(request, **kwargs)
 
 
@@ -103,10 +114,13 @@ class CreateReview(LoginRequiredMixin, CreateView):
         """
         return reverse_lazy('webble:book_detail', kwargs={'pk': self.kwargs['pk']})
 
+    @transaction.atomic
     def form_valid(self, form):
         form.instance.user = self.request.user
         form.instance.book = Book.objects.get(pk=self.kwargs['pk'])
-        return super().form_valid(form)
+        response = super().form_valid(form)
+        update_book_rating(form.instance.book_id, added=form.instance.rating)
+        return response
 
 
 class UpdateReview(LoginRequiredMixin, UpdateView):
@@ -128,6 +142,15 @@ class UpdateReview(LoginRequiredMixin, UpdateView):
         """
         return Review.objects.get(user=self.request.user, pk=self.kwargs['review'])
 
+    @transaction.atomic
+    def form_valid(self, form):
+        """
+        Saves the review and moves the book rating aggregates from the previous rating to the new one.
+        """
+        response = super().form_valid(form)
+        update_book_rating(self.object.book_id, added=self.object.rating, removed=form.initial['rating'])
+        return response
+
 
 class DeleteReview(LoginRequiredMixin, DeleteView):
     model = Review
@@ -147,3 +170,13 @@ class DeleteReview(LoginRequiredMixin, DeleteView):
         :return: Review object.
         """
         return Review.objects.get(user=self.request.user, pk=self.kwargs['review'])
+
+    @transaction.atomic
+    def form_valid(self, form):
+        """
+        Deletes the review and removes its rating from the book rating aggregates.
+        """
+        book_pk, rating = self.object.book_id, self.object.rating
+        response = super().form_valid(form)
+        update_book_rating(book_pk, removed=rating)
+        return response
@@ -1,10 +1,20 @@
 from django.contrib import admin
-from .models import Book, Author, Genre
+from django.db import transaction
+
+from .methods.catalogue import bump_cache_versions
+from .methods.helper import get_wiki_data
+from .methods.ingest import enrich_author
+from .methods.search import index_entry, AUTHOR, BOOK
+from .models import Book, Author, Genre, IngestJob
 
 
 class BookAdmin(admin.ModelAdmin):
-    list_display = ('title', 'description', 'display_authors', 'display_genres', 'publish_date')
+    list_display = ('title', 'description', 'display_authors', 'display_genres', 'publish_date', 'status')
     search_fields = ('title', 'authors__name',)
+    actions = ['refresh_from_wiki']
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).with_relations()
 
     def display_authors(self, obj):
         return ', '.join([author.name for author in obj.authors.all()])
@@ -14,12 +24,46 @@ class BookAdmin(admin.ModelAdmin):
         return ', '.join([genre.genre for genre in obj.genres.all()])
     display_genres.short_description = 'Genres'
 
+    def refresh_from_wiki(self, request, queryset):
+        books = list(queryset)
+        wiki_data = get_wiki_data([book.title for book in books], images=False)
+        for book in books:
+            book.description = wiki_data[book.title][0]
+        Book.objects.bulk_update(books, ['description'])
+        # bulk_update sends no post_save, so reindex and drop the cached pages here
+        for book in books:
+            index_entry(BOOK, book.pk, book.title, book.description)
+        transaction.on_commit(lambda: bump_cache_versions('catalogue'))
+        self.message_user(request, f'Refreshed {len(books)} book descriptions')
+    refresh_from_wiki.short_description = 'Refresh descriptions from Wikipedia'
+
 
 class AuthorAdmin(admin.ModelAdmin):
-    list_display = ('name', 'bio')
+    list_display = ('name', 'bio', 'status')
     search_fields = ('name',)
+    actions = ['refresh_from_wiki']
+
+    def refresh_from_wiki(self, request, queryset):
+        authors = list(queryset)
+        wiki_data = get_wiki_data([author.name for author in authors])
+        updated_fields = set()
+        for author in authors:
+            updated_fields.update(enrich_author(author, wiki_data[author.name]))
+        Author.objects.bulk_update(authors, list(updated_fields))
+        # bulk_update sends no post_save, so reindex and drop the cached pages here
+        for author in authors:
+            index_entry(AUTHOR, author.pk, author.name, author.bio)
+        transaction.on_commit(lambda: bump_cache_versions('catalogue'))
+        self.message_user(request, f'Refreshed {len(authors)} author bios and portraits')
+    refresh_from_wiki.short_description = 'Refresh bios and portraits from Wikipedia'
+
+
+class IngestJobAdmin(admin.ModelAdmin):
+    list_display = ('__str__', 'status', 'attempts', 'run_after', 'claimed_at', 'last_error')
+    list_filter = ('status',)
 
 
 admin.site.register(Book, BookAdmin)
 admin.site.register(Author, AuthorAdmin)
 admin.site.register(Genre)
+admin.site.register(IngestJob, IngestJobAdmin)
@@ -0,0 +1,49 @@
+from .methods.api import ApiView
+from .models import Book, Author, Genre
+
+
+def get_file_url(file):
+    return file.url if file else None
+
+
+class BookApiView(ApiView):
+    """
+    Books with their author and genre primary keys and rating aggregates.
+    """
+    model = Book
+    cache_scopes = ('catalogue', 'ratings')
+    api_fields = {
+        'id': lambda book: book.pk,
+        'title': lambda book: book.title,
+        'authors': lambda book: [author.pk for author in book.authors.all()],
+        'genres': lambda book: [genre.pk for genre in book.genres.all()],
+        'publish_date': lambda book: book.publish_date,
+        'description': lambda book: book.description,
+        'page_count': lambda book: book.page_count,
+        'cover': lambda book: get_file_url(book.cover_image),
+        'rating': lambda book: book.rating,
+        'rating_count': lambda book: book.rating_count,
+        'status': lambda book: book.status,
+    }
+    api_prefetch = {'authors': ('authors',), 'genres': ('genres',)}
+
+
+class AuthorApiView(ApiView):
+    model = Author
+    cache_scopes = ('catalogue',)
+    api_fields = {
+        'id': lambda author: author.pk,
+        'name': lambda author: author.name,
+        'bio': lambda author: author.bio,
+        'portrait': lambda author: get_file_url(author.portrait),
+        'status': lambda author: author.status,
+    }
+
+
+class GenreApiView(ApiView):
+    model = Genre
+    cache_scopes = ('catalogue',)
+    api_fields = {
+        'id': lambda genre: genre.pk,
+        'genre': lambda genre: genre.genre,
+    }
@@ -1,6 +1,15 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_migrate
 
 
 class WebbleConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'webble'
+
+    def ready(self):
+        from . import signals  # noqa: F401
+        from .methods.database import configure_sqlite
+        from .methods.search import create_search_table
+        connection_created.connect(configure_sqlite)
+        post_migrate.connect(create_search_table, sender=self)
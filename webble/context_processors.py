@@ -1,8 +1,10 @@
+from .methods.catalogue import get_genre_catalogue
 from .models import Genre
 
 
 # Obtain all Genres to iterate through them and display navbar choices in base.html.
+# The list is cached per process and invalidated when a Genre is saved or deleted.
 def get_genres(request):
     return {
-        'genres': Genre.objects.all()
+        'genres': get_genre_catalogue(Genre)
     }
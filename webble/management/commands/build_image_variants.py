@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from webble.methods.catalogue import bump_cache_versions
+from webble.methods.images import build_variants
+from webble.models import Book, Author
+
+
+class Command(BaseCommand):
+    help = 'Build the resized variants of book covers and author portraits that are missing or outdated.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='Rebuild the variants of every image.')
+
+    def handle(self, *args, **options):
+        for model, field in ((Book, 'cover_image'), (Author, 'portrait')):
+            built = 0
+            for obj in model.objects.only('pk', field, 'image_variants'):
+                image = getattr(obj, field)
+                if not image or (not options['all'] and obj.image_variants.get('source') == image.name):
+                    continue
+                obj.image_variants = build_variants(image)
+                model.objects.filter(pk=obj.pk).update(image_variants=obj.image_variants)
+                built += 1
+            self.stdout.write(f'Built variants of {built} {model._meta.verbose_name_plural}')
+        bump_cache_versions('catalogue')
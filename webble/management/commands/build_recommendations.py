@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from user.models import ReadingProgress
+from webble.methods.catalogue import bump_cache_versions
+from webble.methods.recommend import rebuild_recommendations
+from webble.models import Book, SimilarBook
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the precomputed similar book recommendations.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--book', type=int, action='append', help='Only rebuild the given book primary key(s).')
+
+    def handle(self, *args, **options):
+        books = Book.objects.all()
+        if options['book']:
+            books = books.filter(pk__in=options['book'])
+        count = 0
+        for book in books.iterator():
+            rebuild_recommendations(book, SimilarBook, ReadingProgress)
+            count += 1
+        bump_cache_versions('catalogue')
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt recommendations of {count} books'))
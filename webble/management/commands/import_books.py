@@ -0,0 +1,176 @@
+import csv
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from django.core.files import File
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from webble.methods.catalogue import bump_cache_versions, invalidate_genre_catalogue
+from webble.methods.ingest import hash_pdf_file, read_pdf_file, PENDING_PORTRAIT
+from webble.models import Book, Author, Genre, IngestJob, RecommendationJob, PENDING
+
+
+def split_names(value):
+    """
+    Manifest authors and genres are either lists (JSONL) or ';' separated strings (CSV).
+    """
+    if isinstance(value, list):
+        names = value
+    else:
+        names = (value or '').split(';')
+    return [name.strip() for name in names if name and name.strip()]
+
+
+class Command(BaseCommand):
+    help = 'Import PDF books from a directory or a CSV/JSONL manifest. Already imported files are skipped.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('source', help='Directory of PDF files, or a .csv/.jsonl manifest with the columns '
+                                           'file, title, authors and genres.')
+        parser.add_argument('--workers', type=int, default=None, help='Number of worker processes.')
+        parser.add_argument('--batch-size', type=int, default=200, help='Books written per transaction.')
+
+    def read_entries(self, source):
+        """
+        Build the list of entries to import from the source.
+
+        :param source: Path of the directory or manifest
+        :return: List of dictionaries with path, title, authors and genres keys
+        """
+        if source.is_dir():
+            return [{'path': str(path), 'title': path.stem, 'authors': [], 'genres': []}
+                    for path in sorted(source.glob('*.pdf'))]
+        if source.suffix == '.csv':
+            with open(source, newline='', encoding='utf-8') as manifest:
+                rows = list(csv.DictReader(manifest))
+        elif source.suffix == '.jsonl':
+            with open(source, encoding='utf-8') as manifest:
+                rows = [json.loads(line) for line in manifest if line.strip()]
+        else:
+            raise CommandError(f'{source} is neither a directory nor a .csv/.jsonl manifest')
+        return [{'path': str(source.parent / row['file']),
+                 'title': row.get('title') or Path(row['file']).stem,
+                 'authors': split_names(row.get('authors')),
+                 'genres': split_names(row.get('genres'))} for row in rows]
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        entries = self.read_entries(Path(options['source']))
+        with ProcessPoolExecutor(max_workers=options['workers']) as executor:
+            hashes = dict(executor.map(hash_pdf_file, [entry['path'] for entry in entries], chunksize=16))
+            entries = [entry for entry in entries if self.readable(entry, hashes[entry['path']])]
+            imported = set(Book.objects.filter(file_hash__in=set(hashes.values())).values_list('file_hash', flat=True))
+            new_entries = {}
+            for entry in entries:
+                file_hash = hashes[entry['path']]
+                if file_hash not in imported and file_hash not in new_entries:
+                    new_entries[file_hash] = entry
+            self.stdout.write(f'{len(entries)} files, {len(entries) - len(new_entries)} already imported')
+
+            batch = []
+            created = 0
+            results = executor.map(read_pdf_file, [entry['path'] for entry in new_entries.values()], chunksize=4)
+            for (file_hash, entry), (_, page_count, cover_data) in zip(new_entries.items(), results):
+                if not self.readable(entry, page_count):
+                    continue
+                batch.append((file_hash, entry, page_count, cover_data))
+                if len(batch) >= options['batch_size']:
+                    created += self.write_batch(batch)
+                    batch = []
+            if batch:
+                created += self.write_batch(batch)
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {created} books in {elapsed:.1f}s ({created / elapsed if elapsed else 0:.1f} books/s)'))
+
+    def readable(self, entry, result):
+        """
+        Report entries whose file couldn't be read, they are skipped.
+
+        :param entry: Entry dictionary
+        :param result: Hash or page count obtained from the file, None if it couldn't be read
+        :return: True if the entry can be imported
+        """
+        if result is None:
+            self.stderr.write(f'Skipping {entry["path"]}, it is missing or not a readable PDF')
+        return result is not None
+
+    @staticmethod
+    def get_or_create_by_name(model, field, names, **defaults):
+        """
+        Fetch the existing rows by name and bulk create the missing ones.
+
+        :return: Tuple of dictionary mapping names to objects and the list of created objects
+        """
+        existing = {getattr(obj, field): obj for obj in model.objects.filter(**{f'{field}__in': names})}
+        missing = [model(**{field: name}, **defaults) for name in names if name not in existing]
+        model.objects.bulk_create(missing)
+        existing.update({getattr(obj, field): obj for obj in model.objects.filter(**{f'{field}__in': names})})
+        return existing, [existing[getattr(obj, field)] for obj in missing]
+
+    def write_batch(self, batch):
+        """
+        Store the files of a batch and write its books, authors, genres and relations with bulk queries.
+        Each batch is committed separately, so an interrupted import resumes where it stopped.
+        Files of a failed batch are deleted again, so they don't linger in the storage without their books.
+
+        :param batch: List of (file hash, entry, page count, cover data) tuples
+        :return: Number of created books
+        """
+        saved_files = []
+        try:
+            with transaction.atomic():
+                return self.write_books(batch, saved_files)
+        except Exception:
+            for field_file in saved_files:
+                field_file.storage.delete(field_file.name)
+            raise
+
+    def write_books(self, batch, saved_files):
+        """
+        Write the batch, see write_batch.
+
+        :param batch: List of (file hash, entry, page count, cover data) tuples
+        :param saved_files: List the stored files are appended to
+        :return: Number of created books
+        """
+        author_names = {name[:60] for _, entry, _, _ in batch for name in entry['authors']}
+        genre_names = {name[:20] for _, entry, _, _ in batch for name in entry['genres']}
+        authors, new_authors = self.get_or_create_by_name(
+            Author, 'name', author_names, status=PENDING, portrait=PENDING_PORTRAIT)
+        genres, new_genres = self.get_or_create_by_name(Genre, 'genre', genre_names)
+
+        books = []
+        for file_hash, entry, page_count, cover_data in batch:
+            book = Book(title=entry['title'][:60], file_hash=file_hash, page_count=page_count, status=PENDING)
+            with open(entry['path'], 'rb') as pdf_file:
+                book.pdf.save(Path(entry['path']).name, File(pdf_file), save=False)
+            saved_files.append(book.pdf)
+            book.cover_image.save(f'{book.title}.jpg', ContentFile(cover_data), save=False)
+            saved_files.append(book.cover_image)
+            books.append(book)
+        Book.objects.bulk_create(books)
+        books = {book.file_hash: book for book in Book.objects.filter(file_hash__in=[item[0] for item in batch])}
+
+        book_authors, book_genres = [], []
+        for file_hash, entry, _, _ in batch:
+            book = books[file_hash]
+            book_authors += [Book.authors.through(book=book, author=authors[name[:60]]) for name in entry['authors']]
+            book_genres += [Book.genres.through(book=book, genre=genres[name[:20]]) for name in entry['genres']]
+        Book.authors.through.objects.bulk_create(book_authors, ignore_conflicts=True)
+        Book.genres.through.objects.bulk_create(book_genres, ignore_conflicts=True)
+
+        IngestJob.objects.bulk_create([IngestJob(book=book) for book in books.values()]
+                                      + [IngestJob(author=author) for author in new_authors])
+        # bulk_create sends no signals, so the work of the receivers in webble.signals is done here
+        if new_genres:
+            transaction.on_commit(invalidate_genre_catalogue)
+        RecommendationJob.enqueue([book.pk for book in books.values()], refresh_similar=True)
+        transaction.on_commit(lambda: bump_cache_versions('catalogue'))
+        self.stdout.write(f'Wrote {len(books)} books, {len(new_authors)} new authors')
+        return len(books)
@@ -0,0 +1,31 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from webble.models import IngestJob, RecommendationJob
+
+
+class Command(BaseCommand):
+    help = 'Process queued Author and Book enrichment jobs and recommendation rebuilds. ' \
+           'Several workers can run side by side.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Exit once no job is due instead of polling.')
+        parser.add_argument('--interval', type=float, default=5, help='Seconds to wait between polls.')
+        parser.add_argument('--batch-size', type=int, default=20,
+                            help='Jobs claimed at once, their Wiki data is fetched with batched requests.')
+
+    def handle(self, *args, **options):
+        while True:
+            jobs = IngestJob.claim_batch(options['batch_size'])
+            if jobs:
+                IngestJob.run_batch(jobs)
+                for job in jobs:
+                    self.stdout.write(f'{job} after {job.attempts} attempt(s)')
+            rebuilt = RecommendationJob.run_pending(options['batch_size'])
+            if rebuilt:
+                self.stdout.write(f'Rebuilt recommendations of {rebuilt} book(s)')
+            if not jobs and not rebuilt:
+                if options['once']:
+                    break
+                time.sleep(options['interval'])
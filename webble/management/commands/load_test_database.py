@@ -0,0 +1,103 @@
+import random
+import statistics
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, OperationalError
+from django.test.utils import override_settings
+
+# Connection settings of a plain SQLite connection, as opened before SQLITE_PRAGMAS was applied
+BASELINE_PRAGMAS = {'busy_timeout': 5000, 'journal_mode': 'DELETE', 'synchronous': 'FULL'}
+ALIAS = 'load_test'
+
+
+class Command(BaseCommand):
+    help = 'Measure "database is locked" errors and query latency of concurrent page reads and progress writes ' \
+           'on a scratch SQLite database, with plain connections and with SQLITE_PRAGMAS.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=16, help='Concurrent clients.')
+        parser.add_argument('--duration', type=float, default=10, help='Seconds each profile is run.')
+        parser.add_argument('--write-ratio', type=float, default=0.2, help='Share of requests writing progress.')
+        parser.add_argument('--rows', type=int, default=5000, help='Rows in the scratch table.')
+
+    def handle(self, *args, **options):
+        if connections['default'].vendor != 'sqlite':
+            raise CommandError('The load test measures SQLite locking, the default database is not SQLite.')
+        for label, pragmas in (('baseline', BASELINE_PRAGMAS), ('tuned', settings.SQLITE_PRAGMAS)):
+            with tempfile.TemporaryDirectory() as directory, override_settings(SQLITE_PRAGMAS=pragmas):
+                connections.settings[ALIAS] = {**connections.settings['default'],
+                                               'NAME': Path(directory) / 'load_test.sqlite3'}
+                try:
+                    self.create_table(options['rows'])
+                    latencies, errors = self.run_clients(options)
+                finally:
+                    del connections.settings[ALIAS]
+            self.report(label, latencies, errors)
+
+    @staticmethod
+    def close_connection():
+        connections[ALIAS].close()
+        del connections[ALIAS]
+
+    def create_table(self, rows):
+        """
+        Create the scratch table read and written by the clients.
+
+        :param rows: Number of rows
+        """
+        with connections[ALIAS].cursor() as cursor:
+            cursor.execute('CREATE TABLE progress (id INTEGER PRIMARY KEY, last_page_read INTEGER, text TEXT)')
+            cursor.executemany('INSERT INTO progress VALUES (%s, 0, %s)', [(row, 'x' * 500) for row in range(rows)])
+        self.close_connection()
+
+    def run_clients(self, options):
+        """
+        Run the clients for the configured duration.
+
+        :return: Tuple of the list of successful request latencies in seconds and the number of lock errors
+        """
+        latencies, errors = [], []
+        deadline = time.monotonic() + options['duration']
+        threads = [threading.Thread(target=self.client, args=(deadline, options, latencies, errors))
+                   for _ in range(options['threads'])]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return latencies, len(errors)
+
+    def client(self, deadline, options, latencies, errors):
+        """
+        Send requests until the deadline, each thread uses its own connection.
+        Reads fetch a range of rows, writes read a row and move its progress forward like a page turn.
+        """
+        try:
+            while time.monotonic() < deadline:
+                row = random.randrange(options['rows'])
+                started = time.perf_counter()
+                try:
+                    with connections[ALIAS].cursor() as cursor:
+                        cursor.execute('SELECT id, last_page_read, text FROM progress WHERE id BETWEEN %s AND %s',
+                                       [row, row + 20])
+                        cursor.fetchall()
+                        if random.random() < options['write_ratio']:
+                            cursor.execute('UPDATE progress SET last_page_read = last_page_read + 1 WHERE id = %s',
+                                           [row])
+                except OperationalError:
+                    errors.append(row)
+                else:
+                    latencies.append(time.perf_counter() - started)
+        finally:
+            self.close_connection()
+
+    def report(self, label, latencies, errors):
+        requests = len(latencies) + errors
+        percentiles = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else [0] * 99
+        self.stdout.write(f'{label}: {requests} requests, {errors} lock errors '
+                          f'({errors / requests * 100 if requests else 0:.2f}%), '
+                          f'p50 {percentiles[49] * 1000:.1f}ms, p99 {percentiles[98] * 1000:.1f}ms')
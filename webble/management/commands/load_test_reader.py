@@ -0,0 +1,151 @@
+import asyncio
+import logging
+import random
+import statistics
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.test import AsyncRequestFactory, RequestFactory
+from django.test.utils import override_settings
+
+from user.methods.progress import progress_tracker
+from webble.models import Book
+from webble.views import AsyncPageImageView, AsyncReadBookView, PageImageView, ReadBookView
+
+USERNAME = 'load-test-reader'
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Compare the latency and throughput of concurrent readers served by the sync reader views on a ' \
+           'WSGI sized thread pool and by the async reader views on a single event loop.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--book', type=int, default=None, help='Primary key of the book read, '
+                                                                   'the first book with pages by default.')
+        parser.add_argument('--clients', type=int, default=32, help='Concurrent readers.')
+        parser.add_argument('--threads', type=int, default=8, help='Worker threads of the WSGI path.')
+        parser.add_argument('--duration', type=float, default=10, help='Seconds each path is run.')
+
+    def handle(self, *args, **options):
+        books = Book.objects.filter(page_count__gt=0)
+        book = books.filter(pk=options['book']).first() if options['book'] else books.order_by('pk').first()
+        if book is None:
+            raise CommandError('No book with pages to read.')
+        user, created = User.objects.get_or_create(username=USERNAME)
+        try:
+            for label, run in ((f'wsgi ({options["threads"]} threads)', self.run_sync),
+                               ('asgi (1 event loop)', self.run_async)):
+                # Every path starts with an empty page cache and renders only the requested pages
+                with tempfile.TemporaryDirectory() as directory, \
+                        override_settings(PAGE_CACHE_DIR=directory, PAGE_CACHE_MEMORY_BYTES=0, PAGE_PREFETCH_DEPTH=0):
+                    latencies, errors = [], []
+                    started = time.monotonic()
+                    run(book, user, options, latencies, errors)
+                    self.report(label, latencies, errors, time.monotonic() - started)
+        finally:
+            progress_tracker.flush()
+            # An existing account of the same name is kept, together with its reviews, bookmarks and progress
+            if created:
+                user.delete()
+
+    @staticmethod
+    def get_paths(book, rng):
+        """
+        A reader opens a random page of the book and then loads its image.
+
+        :return: List of (path, page number) tuples requested one after the other
+        """
+        page = rng.randint(1, book.page_count)
+        return [(f'/book/{book.pk}/page/{page}/', page), (f'/book/{book.pk}/page/{page}.jpg', page)]
+
+    @staticmethod
+    def record(response, started, latencies, errors):
+        """
+        Record the latency of a successful request, or the status code of a failed one.
+        """
+        if response.status_code == 200:
+            latencies.append(time.perf_counter() - started)
+        else:
+            errors.append(response.status_code)
+
+    @staticmethod
+    def record_exception(path, errors):
+        """
+        Log an exception raised by a view, which a server would have answered with 500.
+        """
+        logger.exception('Requesting %s failed', path)
+        errors.append(500)
+
+    def run_sync(self, book, user, options, latencies, errors):
+        """
+        Each reader hands its requests to a shared pool of worker threads, like a threaded WSGI server.
+        """
+        factory = RequestFactory()
+        views = [ReadBookView.as_view(), PageImageView.as_view()]
+        deadline = time.monotonic() + options['duration']
+
+        def serve(view, path, page):
+            request = factory.get(path)
+            request.user = user
+            response = view(request, pk=book.pk, page_number=page)
+            return response.render() if hasattr(response, 'render') else response
+
+        def reader(seed, workers):
+            rng = random.Random(seed)
+            while time.monotonic() < deadline:
+                for view, (path, page) in zip(views, self.get_paths(book, rng)):
+                    started = time.perf_counter()
+                    try:
+                        response = workers.submit(serve, view, path, page).result()
+                    except Exception:
+                        self.record_exception(path, errors)
+                    else:
+                        self.record(response, started, latencies, errors)
+
+        with ThreadPoolExecutor(max_workers=options['threads']) as workers:
+            readers = [threading.Thread(target=reader, args=(seed, workers)) for seed in range(options['clients'])]
+            for thread in readers:
+                thread.start()
+            for thread in readers:
+                thread.join()
+
+    def run_async(self, book, user, options, latencies, errors):
+        """
+        Every reader is a coroutine on one event loop, like a single ASGI worker.
+        """
+        factory = AsyncRequestFactory()
+        views = [AsyncReadBookView.as_view(), AsyncPageImageView.as_view()]
+        deadline = time.monotonic() + options['duration']
+
+        async def reader(seed):
+            rng = random.Random(seed)
+            while time.monotonic() < deadline:
+                for view, (path, page) in zip(views, self.get_paths(book, rng)):
+                    request = factory.get(path)
+                    request.user = user
+                    started = time.perf_counter()
+                    try:
+                        response = await view(request, pk=book.pk, page_number=page)
+                    except Exception:
+                        self.record_exception(path, errors)
+                    else:
+                        self.record(response, started, latencies, errors)
+
+        async def readers():
+            await asyncio.gather(*(reader(seed) for seed in range(options['clients'])))
+
+        asyncio.run(readers())
+
+    def report(self, label, latencies, errors, elapsed):
+        requests = len(latencies) + len(errors)
+        percentiles = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else [0] * 99
+        refused = errors.count(503)
+        self.stdout.write(f'{label}: {requests} requests, {refused} refused with 503, {len(errors) - refused} failed, '
+                          f'{requests / elapsed if elapsed else 0:.1f} req/s, '
+                          f'p50 {percentiles[49] * 1000:.1f}ms, p99 {percentiles[98] * 1000:.1f}ms')
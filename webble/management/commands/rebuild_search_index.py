@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from webble.methods.search import create_search_table, index_entry, index_book_pages, BOOK, AUTHOR
+from webble.models import Book, Author, READY
+
+
+class Command(BaseCommand):
+    help = 'Index every author, book and book page for search.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--skip-pages', action='store_true', help='Only index book and author details.')
+
+    def handle(self, *args, **options):
+        create_search_table()
+        for author in Author.objects.all():
+            index_entry(AUTHOR, author.pk, author.name, author.bio)
+        for book in Book.objects.all():
+            index_entry(BOOK, book.pk, book.title, book.description)
+            if not options['skip_pages'] and book.status == READY:
+                index_book_pages(book)
+                self.stdout.write(f'Indexed {book} pages')
+        self.stdout.write(self.style.SUCCESS('Search index rebuilt'))
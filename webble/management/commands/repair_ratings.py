@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+
+from user.models import Review
+from webble.methods.catalogue import bump_cache_versions
+from webble.models import Book
+
+RATING_FIELDS = ['rating_sum', 'rating_count', 'rating_count_1', 'rating_count_2', 'rating_count_3',
+                 'rating_count_4', 'rating_count_5']
+
+
+class Command(BaseCommand):
+    help = 'Recompute the rating aggregates of every book from its reviews.'
+
+    @transaction.atomic
+    def handle(self, *args, **options):
+        aggregates = {}
+        for row in Review.objects.order_by().values('book', 'rating').annotate(reviews=Count('id')):
+            book_aggregates = aggregates.setdefault(row['book'], dict.fromkeys(RATING_FIELDS, 0))
+            book_aggregates['rating_sum'] += row['rating'] * row['reviews']
+            book_aggregates['rating_count'] += row['reviews']
+            book_aggregates[f'rating_count_{row["rating"]}'] += row['reviews']
+        books = list(Book.objects.only('pk', *RATING_FIELDS))
+        for book in books:
+            for field, value in aggregates.get(book.pk, dict.fromkeys(RATING_FIELDS, 0)).items():
+                setattr(book, field, value)
+        Book.objects.bulk_update(books, RATING_FIELDS, batch_size=500)
+        transaction.on_commit(lambda: bump_cache_versions('catalogue', 'ratings'))
+        self.stdout.write(self.style.SUCCESS(f'Recomputed ratings of {len(books)} books'))
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from webble.methods.catalogue import bump_cache_versions
+from webble.models import Book, Genre, get_random_key
+
+
+class Command(BaseCommand):
+    help = 'Assign new random keys to books and genres, changing the random picks and orders shown. ' \
+           'Meant to be run periodically, e.g. from cron.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Rows updated per query batch.')
+
+    def handle(self, *args, **options):
+        for model in (Book, Genre):
+            objects = list(model.objects.only('pk'))
+            for obj in objects:
+                obj.random_key = get_random_key()
+            model.objects.bulk_update(objects, ['random_key'], batch_size=options['batch_size'])
+            self.stdout.write(f'Shuffled {len(objects)} {model._meta.verbose_name_plural}')
+        bump_cache_versions('catalogue')
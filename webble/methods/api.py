@@ -0,0 +1,134 @@
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse, JsonResponse
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.decorators import method_decorator
+from django.utils.http import quote_etag
+from django.views import View
+from django.views.decorators.gzip import gzip_page
+
+from .catalogue import get_cache_versions
+from .pagination import encode_cursor, decode_cursor, keyset_filter
+
+
+@method_decorator(gzip_page, name='dispatch')
+class ApiView(View):
+    """
+    Read-only JSON endpoint listing the rows of a model.
+
+    Query parameters:
+    fields - comma separated names of the returned fields, all fields of api_fields by default
+    ids - comma separated primary keys, returns these rows instead of a page
+    cursor - cursor of the next page, as returned in the next attribute of the previous page
+    limit - number of rows per page, up to API_MAX_PAGE_SIZE
+
+    The body is compact JSON with the keys in a fixed order, gzipped for clients accepting it.
+    Responses carry an ETag and answer If-None-Match with 304. Endpoints listing cache_scopes
+    derive the ETag from the scope versions, so unchanged data is confirmed without any query.
+    Related rows of the selected fields are loaded with one query each, never per row.
+    """
+    model = None
+    # Field name mapped to a function returning the value of a row
+    api_fields = {}
+    # Field name mapped to the select_related and prefetch_related lookups it needs
+    api_select = {}
+    api_prefetch = {}
+    cache_scopes = ()
+
+    def get_queryset(self):
+        return self.model.objects.all()
+
+    def get_fields(self):
+        """
+        :return: List of the selected field names
+        :raises ValueError: If an unknown field is selected
+        """
+        fields = [field for field in self.request.GET.get('fields', '').split(',') if field]
+        unknown = set(fields) - self.api_fields.keys()
+        if unknown:
+            raise ValueError(f'Unknown fields: {", ".join(sorted(unknown))}')
+        return fields or list(self.api_fields)
+
+    def get_ids(self):
+        """
+        :return: List of the requested primary keys or None
+        :raises ValueError: If the ids are not numbers or too many
+        """
+        if 'ids' not in self.request.GET:
+            return None
+        ids = [int(pk) for pk in self.request.GET['ids'].split(',') if pk]
+        if len(ids) > settings.API_MAX_PAGE_SIZE:
+            raise ValueError(f'At most {settings.API_MAX_PAGE_SIZE} ids can be fetched at once')
+        return ids
+
+    def get_limit(self):
+        limit = int(self.request.GET.get('limit', settings.API_PAGE_SIZE))
+        if not 0 < limit <= settings.API_MAX_PAGE_SIZE:
+            raise ValueError(f'limit must be between 1 and {settings.API_MAX_PAGE_SIZE}')
+        return limit
+
+    def get_cursor(self):
+        """
+        :return: Primary key of the last row of the previous page or None
+        :raises ValueError: If the cursor is malformed
+        """
+        cursor = self.request.GET.get('cursor')
+        if not cursor:
+            return None
+        direction, values = decode_cursor(cursor, ['pk'], self.get_queryset())
+        if direction != 'after':
+            raise ValueError('Invalid cursor')
+        return values[0]
+
+    def get_rows(self, fields, ids, limit, after):
+        """
+        Fetch the requested rows with the related rows of the selected fields.
+
+        :param after: Primary key the page starts after or None for the first page
+        :return: Tuple of the list of rows and the cursor of the next page or None
+        """
+        queryset = self.get_queryset()
+        select = [lookup for field in fields for lookup in self.api_select.get(field, ())]
+        prefetch = [lookup for field in fields for lookup in self.api_prefetch.get(field, ())]
+        queryset = queryset.select_related(*select).prefetch_related(*prefetch).order_by('pk')
+        if ids is not None:
+            return list(queryset.filter(pk__in=ids)), None
+        if after is not None:
+            queryset = queryset.filter(keyset_filter(['pk'], [after]))
+        rows = list(queryset[:limit + 1])
+        return rows[:limit], encode_cursor('after', [rows[limit - 1].pk]) if len(rows) > limit else None
+
+    def get(self, request, *args, **kwargs):
+        try:
+            fields, ids, limit, after = self.get_fields(), self.get_ids(), self.get_limit(), self.get_cursor()
+        except ValueError as error:
+            return JsonResponse({'error': str(error)}, status=400)
+        etag = None
+        if self.cache_scopes:
+            versions = '|'.join(get_cache_versions(self.cache_scopes).values())
+            etag = quote_etag(hashlib.sha1(f'{request.get_full_path()}|{versions}'.encode()).hexdigest())
+            response = get_conditional_response(request, etag=etag)
+            if response is not None:
+                return self.finalize(response, etag)
+        rows, next_cursor = self.get_rows(fields, ids, limit, after)
+        body = json.dumps({'results': [{field: self.api_fields[field](row) for field in fields} for row in rows],
+                           'next': next_cursor}, cls=DjangoJSONEncoder, separators=(',', ':'))
+        if etag is None:
+            etag = quote_etag(hashlib.sha1(body.encode()).hexdigest())
+            response = get_conditional_response(request, etag=etag)
+            if response is not None:
+                return self.finalize(response, etag)
+        return self.finalize(HttpResponse(body, content_type='application/json'), etag)
+
+    @staticmethod
+    def finalize(response, etag):
+        """
+        Add the validators and make clients revalidate their copy on every use.
+        """
+        response['ETag'] = etag
+        patch_cache_control(response, private=True, max_age=0)
+        patch_vary_headers(response, ('Cookie',))
+        return response
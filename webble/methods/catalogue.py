@@ -0,0 +1,68 @@
+import threading
+import uuid
+
+from django.core.cache import cache
+
+# Django cache key holding the current version of the genre catalogue
+GENRE_VERSION_KEY = 'webble:genre_catalogue_version'
+
+_local = {'version': None, 'genres': []}
+_lock = threading.Lock()
+
+
+def get_genre_catalogue(genre_model):
+    """
+    Obtain all genres for the navbar from a process-local copy.
+    The copy is only reloaded from the database when the version stored in Django's cache changes,
+    so in the steady state the navbar costs a cache lookup and no queries.
+
+    :param genre_model: Genre model
+    :return: List of Genre objects
+    """
+    version = cache.get(GENRE_VERSION_KEY)
+    if version is None:
+        cache.add(GENRE_VERSION_KEY, uuid.uuid4().hex, timeout=None)
+        version = cache.get(GENRE_VERSION_KEY)
+    with _lock:
+        if _local['version'] == version:
+            return _local['genres']
+    genres = list(genre_model.objects.all())
+    with _lock:
+        _local['version'], _local['genres'] = version, genres
+    return genres
+
+
+def invalidate_genre_catalogue():
+    """
+    Bump the catalogue version, so every process reloads its copy on the next request.
+    """
+    cache.set(GENRE_VERSION_KEY, uuid.uuid4().hex, timeout=None)
+
+
+# Django cache key prefix of the versions that cached pages and template fragments are keyed by
+CACHE_VERSION_KEY = 'webble:cache_version:'
+
+
+def get_cache_versions(names):
+    """
+    Obtain the current versions of the named cache scopes, e.g. 'catalogue' or 'book:1', with one cache lookup.
+    Scopes without a version get one.
+
+    :param names: Scope names
+    :return: Dictionary mapping the scope names to their versions
+    """
+    keys = {f'{CACHE_VERSION_KEY}{name}': name for name in names}
+    versions = cache.get_many(keys)
+    for key in keys.keys() - versions.keys():
+        cache.add(key, uuid.uuid4().hex, timeout=None)
+        versions[key] = cache.get(key)
+    return {name: versions[key] for key, name in keys.items()}
+
+
+def bump_cache_versions(*names):
+    """
+    Give the named cache scopes new versions, so pages and fragments cached under the old ones are no longer used.
+
+    :param names: Scope names
+    """
+    cache.set_many({f'{CACHE_VERSION_KEY}{name}': uuid.uuid4().hex for name in names}, timeout=None)
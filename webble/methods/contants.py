@@ -1,10 +1,20 @@
-# Wiki API for images
-WIKI_IMAGE = 'http://en.wikipedia.org/w/api.php?action=query&prop=pageimages&format=json&piprop=original&titles='
+# Wiki API query for page summaries and images
+WIKI_BATCH = {'action': 'query', 'format': 'json', 'prop': 'extracts|pageimages', 'exintro': 'true',
+              'explaintext': 'true', 'exlimit': 'max', 'piprop': 'original'}
 
-# Wiki API for page summary
-WIKI_SUMMARY = 'https://en.wikipedia.org/w/api.php?action=query&' \
-               'format=json&prop=extracts&exintro=true&explaintext=true&titles='
+# Intro extracts are limited to 20 pages per request
+WIKI_BATCH_SIZE = 20
 
 # To mimic request from web browser
 HEADER = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) '
                         'AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537'}
+
+# Reading modes of the reader, rendered page images or the HTML of the page text layer
+READER_MODES = ('image', 'text')
+
+# Image formats of the page render profiles, with their Pillow encoder and content type
+RENDER_FORMATS = {
+    'jpeg': ('JPEG', 'image/jpeg'),
+    'webp': ('WEBP', 'image/webp'),
+    'png': ('PNG', 'image/png'),
+}
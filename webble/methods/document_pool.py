@@ -0,0 +1,172 @@
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import fitz
+from django.conf import settings
+
+
+class DocumentBusy(Exception):
+    """
+    Raised when a document is requested without blocking while another thread uses or awaits it.
+    """
+
+
+class PooledDocument:
+    """
+    Open fitz document together with the information the pool needs to manage it.
+    PyMuPDF documents are not safe to use from several threads at once, so every use goes through the lock.
+    Waiting counts the threads blocked on the lock, so background work can make way for them.
+    """
+
+    def __init__(self, pdf_name, document, size):
+        self.pdf_name = pdf_name
+        self.document = document
+        self.size = size
+        self.lock = threading.Lock()
+        self.waiting = 0
+
+    def close(self):
+        with self.lock:
+            self.document.close()
+
+
+class DocumentPool:
+    """
+    Process-wide pool of open fitz documents keyed by book primary key.
+
+    Documents are opened from the file path, so MuPDF only reads the parts of the file it needs
+    instead of the whole book being loaded into a Python bytes object.
+    The least recently used documents are closed once the pool holds more than DOCUMENT_POOL_SIZE
+    documents or their files add up to more than DOCUMENT_POOL_MAX_BYTES.
+    """
+
+    def __init__(self):
+        self._documents = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _open(pdf):
+        """
+        Open the PDF from its path, falling back to reading the stream for storages without local files.
+
+        :param pdf: FieldFile of the PDF
+        :return: Tuple of fitz document and its size in bytes
+        """
+        try:
+            path = pdf.path
+        except NotImplementedError:
+            with pdf.open('rb') as pdf_file:
+                data = pdf_file.read()
+            return fitz.open(stream=data, filetype='pdf'), len(data)
+        return fitz.open(path, filetype='pdf'), os.path.getsize(path)
+
+    def _evict(self):
+        """
+        Remove least recently used documents over the limits. Must be called holding the pool lock.
+        The most recently used document is always kept, even if it exceeds the limits on its own.
+
+        :return: List of removed documents that still have to be closed
+        """
+        evicted = []
+        while len(self._documents) > 1 and (len(self._documents) > settings.DOCUMENT_POOL_SIZE
+                                            or self._size > settings.DOCUMENT_POOL_MAX_BYTES):
+            _, pooled = self._documents.popitem(last=False)
+            self._size -= pooled.size
+            evicted.append(pooled)
+        return evicted
+
+    def _acquire(self, book):
+        """
+        Obtain the pooled document of the book, opening it if it is not pooled yet or its PDF changed.
+
+        :param book: Book object
+        :return: PooledDocument
+        """
+        with self._lock:
+            pooled = self._documents.get(book.pk)
+            if pooled is not None and pooled.pdf_name == book.pdf.name:
+                self._documents.move_to_end(book.pk)
+                return pooled
+        document, size = self._open(book.pdf)
+        fresh = PooledDocument(book.pdf.name, document, size)
+        with self._lock:
+            pooled = self._documents.get(book.pk)
+            if pooled is not None and pooled.pdf_name == book.pdf.name:
+                # Another thread opened the same document in the meantime.
+                self._documents.move_to_end(book.pk)
+                evicted = [fresh]
+            else:
+                stale = self._documents.pop(book.pk, None)
+                evicted = [stale] if stale is not None else []
+                if stale is not None:
+                    self._size -= stale.size
+                self._documents[book.pk] = pooled = fresh
+                self._size += fresh.size
+                evicted += self._evict()
+        for document in evicted:
+            document.close()
+        return pooled
+
+    def _lock_document(self, pooled, blocking):
+        """
+        Take the lock of the pooled document. Without blocking, the lock is only taken if it is free
+        and no other thread waits for it.
+
+        :param pooled: PooledDocument
+        :param blocking: Wait for the lock
+        :raises DocumentBusy: If not blocking and the document is in use or awaited
+        """
+        if not blocking:
+            if pooled.waiting or not pooled.lock.acquire(blocking=False):
+                raise DocumentBusy()
+            return
+        with self._lock:
+            pooled.waiting += 1
+        try:
+            pooled.lock.acquire()
+        finally:
+            with self._lock:
+                pooled.waiting -= 1
+
+    @contextmanager
+    def document(self, book, blocking=True):
+        """
+        Context manager giving exclusive access to the open document of the book.
+
+        :param book: Book object
+        :param blocking: Wait until other threads are done with the document, DocumentBusy is raised otherwise
+        :return: fitz document
+        """
+        pooled = self._acquire(book)
+        self._lock_document(pooled, blocking)
+        try:
+            if pooled.document.is_closed:
+                # Evicted between acquiring and locking, use a private copy for this call.
+                document, _ = self._open(book.pdf)
+                try:
+                    yield document
+                finally:
+                    document.close()
+            else:
+                yield pooled.document
+        finally:
+            pooled.lock.release()
+
+    def discard(self, book_pk):
+        """
+        Close and forget the document of the book, if pooled.
+
+        :param book_pk: Book primary key
+        """
+        with self._lock:
+            pooled = self._documents.pop(book_pk, None)
+            if pooled is not None:
+                self._size -= pooled.size
+        if pooled is not None:
+            pooled.close()
+
+
+document_pool = DocumentPool()
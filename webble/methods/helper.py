@@ -1,9 +1,46 @@
-import base64
+import hashlib
+import io
+import json
+import random
+from concurrent.futures import ThreadPoolExecutor
 
-import requests
 import fitz
+from django.conf import settings
+from PIL import Image
 
-from .contants import WIKI_IMAGE, WIKI_SUMMARY, HEADER
+from .contants import WIKI_BATCH, WIKI_BATCH_SIZE, RENDER_FORMATS
+from .document_pool import document_pool
+from .page_cache import page_cache
+from .wiki import wiki_client
+
+
+def get_wiki_data(queries, images=True):
+    """
+    This function is used to obtain the summaries and images of many Wiki pages at once.
+    Summaries and image URLs are resolved together, WIKI_BATCH_SIZE titles per API request,
+    and the images are downloaded concurrently.
+
+    :param queries: Titles or names of the targets
+    :param images: Whether the images should be downloaded
+    :return: Dictionary mapping every query to a tuple of the summary and the image data or None
+    """
+    queries = list(dict.fromkeys(queries))
+    image_urls = {}
+    results = {}
+    for start in range(0, len(queries), WIKI_BATCH_SIZE):
+        chunk = queries[start:start + WIKI_BATCH_SIZE]
+        response = wiki_client.query({**WIKI_BATCH, 'titles': '|'.join(chunk)})['query']
+        # The API answers with normalized titles, e.g. the first letter capitalized.
+        normalized = {item['from']: item['to'] for item in response.get('normalized', [])}
+        pages = {page['title']: page for page in response['pages'].values()}
+        for query in chunk:
+            page = pages.get(normalized.get(query, query), {})
+            results[query] = page.get('extract', 'Page not found') if 'missing' not in page else 'Page not found'
+            if images and 'source' in page.get('original', {}):
+                image_urls[query] = page['original']['source']
+    with ThreadPoolExecutor(max_workers=settings.WIKI_POOL_SIZE) as executor:
+        image_data = dict(zip(image_urls, executor.map(wiki_client.download, image_urls.values())))
+    return {query: (summary, image_data.get(query)) for query, summary in results.items()}
 
 
 def get_image_data(query):
@@ -13,14 +50,7 @@ def get_image_data(query):
     :param query: Name of the author
     :return: Image data as response content
     """
-    api_res = requests.get(WIKI_IMAGE + query).json()
-    page = api_res['query']['pages'].values()
-    for value in page:
-        if 'original' in value and 'source' in value['original']:
-            url = value['original']['source']
-            response = requests.get(url, headers=HEADER)
-            return response.content
-    return None
+    return get_wiki_data([query])[query][1]
 
 
 def get_summary(query):
@@ -30,12 +60,7 @@ def get_summary(query):
     :param query: Title or name of the target
     :return: Summary of the Wiki page or string if not 'extract'.
     """
-    response = requests.get(WIKI_SUMMARY + query).json()
-    pages = response["query"]["pages"]
-    page_id = next(iter(pages), None)
-    if page_id != "-1" and "extract" in pages[page_id]:
-        return pages[page_id]["extract"]
-    return "Page not found"
+    return get_wiki_data([query], images=False)[query][0]
 
 
 def get_pdf_data(pdf_path):
@@ -62,28 +87,119 @@ def convert_pdf_to_image(pdf_data, page):
     return image_data
 
 
-def decode_image_data(pdf_path, page):
+def render_page(pdf_data, page, profile):
     """
-    This decoder helps ensure that the convert_pdf_to_image is correctly encoded for Jinja.
+    Render a page of the PDF with the resolution, colours, clip region and image format of a render profile.
 
-    :param pdf_path: Path to the PDF file
-    :param page: Page number
-    :return: Encoded image data
+    :param pdf_data: PDF data
+    :param page: Desired page number
+    :param profile: Render profile settings from PAGE_RENDER_PROFILES
+    :return: Image data as bytes
+    """
+    pdf_page = pdf_data.load_page(page)
+    clip = None
+    if profile.get('clip'):
+        x0, y0, x1, y1 = profile['clip']
+        rect = pdf_page.rect
+        clip = fitz.Rect(rect.x0 + rect.width * x0, rect.y0 + rect.height * y0,
+                         rect.x0 + rect.width * x1, rect.y0 + rect.height * y1)
+    colorspace = fitz.csGRAY if profile.get('grayscale') else fitz.csRGB
+    pix = pdf_page.get_pixmap(dpi=profile['dpi'], colorspace=colorspace, clip=clip, alpha=False)
+    image = Image.frombytes('L' if pix.n == 1 else 'RGB', (pix.width, pix.height), pix.samples)
+    image_data = io.BytesIO()
+    image.save(image_data, RENDER_FORMATS[profile['format']][0], quality=profile.get('quality', 85))
+    return image_data.getvalue()
+
+
+def get_render_key(profile_name):
+    """
+    Builds the identifier of a render profile used in page cache keys.
+    It changes whenever the settings of the profile change, so outdated renders are never served.
+
+    :param profile_name: Name of the render profile
+    :return: Render key
+    """
+    profile = settings.PAGE_RENDER_PROFILES[profile_name]
+    digest = hashlib.sha1(json.dumps(profile, sort_keys=True).encode()).hexdigest()[:8]
+    return f'{profile_name}.{digest}.{profile["format"]}'
+
+
+def get_page_image(book, page, profile_name=None, blocking=True):
+    """
+    Obtain the rendered image of a book page.
+    The page is only rendered when it is not in the page cache yet, using the pooled open document of the book.
+
+    :param book: Book object
+    :param page: Desired page number
+    :param profile_name: Name of the render profile, PAGE_DEFAULT_PROFILE if not given
+    :param blocking: Wait for the document if another thread uses it, DocumentBusy is raised otherwise
+    :return: Image data as bytes
+    """
+    profile_name = profile_name or settings.PAGE_DEFAULT_PROFILE
+    cache_key = get_page_cache_key(book, profile_name)
+    image_data = page_cache.get(book.pk, page, cache_key)
+    if image_data is None:
+        with document_pool.document(book, blocking) as pdf_data:
+            # The page may have been rendered by the thread this one waited for
+            image_data = page_cache.get(book.pk, page, cache_key)
+            if image_data is None:
+                image_data = render_page(pdf_data, page, settings.PAGE_RENDER_PROFILES[profile_name])
+                page_cache.set(book.pk, page, cache_key, image_data)
+    return image_data
+
+
+def get_page_cache_key(book, profile_name):
+    """
+    Builds the key rendered pages of the book are cached under.
+    It contains the page version, so once the PDF is replaced no process can hit the pages of the old one,
+    even if they are still in its in-memory cache.
+
+    :param book: Book object
+    :param profile_name: Name of the render profile
+    :return: Page cache key
+    """
+    return f'{get_render_key(profile_name)}.{get_page_version(book, profile_name)}'
+
+
+def get_page_version(book, profile_name=None):
+    """
+    Builds a short token that changes whenever the books PDF or the render profile settings change.
+    Used as ETag and as cache busting query string for the page image URLs.
+
+    :param book: Book object
+    :param profile_name: Name of the render profile, PAGE_DEFAULT_PROFILE if not given
+    :return: Version token
+    """
+    render_key = get_render_key(profile_name or settings.PAGE_DEFAULT_PROFILE)
+    return hashlib.sha1(f'{book.pdf.name}|{render_key}'.encode()).hexdigest()[:12]
+
+
+def sample(queryset, k):
+    """
+    Pick up to k random rows of a queryset whose model has an indexed random_key column.
+    Rows are read along the random_key index from a random starting point, wrapping around to the start,
+    so the database reads about k rows instead of shuffling the whole candidate set.
+
+    :param queryset: Queryset to pick from
+    :param k: Number of rows
+    :return: List of objects
     """
-    image_data = convert_pdf_to_image(pdf_path, page)
-    return base64.b64encode(image_data).decode('ascii')
+    start = random.random()
+    picked = list(queryset.filter(random_key__gte=start).order_by('random_key')[:k])
+    if len(picked) < k:
+        picked += queryset.filter(random_key__lt=start).order_by('random_key')[:k - len(picked)]
+    return picked
 
 
 def get_books_by_genre(genre_model, book_model):
     """
-    Tool takes 4 random genres available in Genre model.
+    Tool takes 3 random genres available in Genre model.
 
     :param genre_model: Genre model
     :param book_model: Book model
     :return: Dictionary containing genres and 6 filtered books for each genre
     """
     genre_books = {}
-    for genre in genre_model.objects.all().order_by('?')[:3]:
-        filtered_books = book_model.objects.filter(genres=genre)
-        genre_books[genre.genre] = filtered_books.order_by('?')[:6]
+    for genre in sample(genre_model.objects.all(), 3):
+        genre_books[genre.genre] = sample(book_model.objects.filter(genres=genre), 6)
     return genre_books
@@ -0,0 +1,43 @@
+import hashlib
+import io
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from PIL import Image, features
+
+# Variant formats with their Pillow encoder and extension, smallest files first
+VARIANT_FORMATS = [('webp', 'WEBP', 'webp'), ('jpeg', 'JPEG', 'jpg')]
+
+
+def build_variants(image):
+    """
+    Store resized WebP and JPEG copies of an image for every width in IMAGE_VARIANT_WIDTHS.
+    Variants are named after the hash of the image content, so identical images share their files
+    and the URLs never have to be invalidated.
+
+    :param image: ImageFieldFile, such as a book cover or an author portrait
+    :return: Dictionary with the source image name and a list of (width, name) pairs per format
+    """
+    with image.open('rb') as image_file:
+        content = image_file.read()
+    digest = hashlib.sha256(content).hexdigest()[:16]
+    source = Image.open(io.BytesIO(content))
+    source.load()
+    widths = sorted({min(width, source.width) for width in settings.IMAGE_VARIANT_WIDTHS})
+    variants = {'source': image.name}
+    for key, encoder, extension in VARIANT_FORMATS:
+        if encoder == 'WEBP' and not features.check('webp'):
+            continue
+        variants[key] = []
+        for width in widths:
+            name = f'{settings.IMAGE_VARIANT_DIR}/{digest}-{width}.{extension}'
+            if not image.storage.exists(name):
+                resized = source.resize((width, max(1, round(source.height * width / source.width))),
+                                        Image.LANCZOS)
+                if encoder == 'JPEG' and resized.mode != 'RGB':
+                    resized = resized.convert('RGB')
+                data = io.BytesIO()
+                resized.save(data, encoder, quality=settings.IMAGE_VARIANT_QUALITY)
+                image.storage.save(name, ContentFile(data.getvalue()))
+            variants[key].append((width, name))
+    return variants
@@ -0,0 +1,91 @@
+import hashlib
+
+from django.core.files.base import ContentFile
+
+from .helper import get_wiki_data, convert_pdf_to_image, get_pdf_data
+from .images import build_variants
+
+# Placeholders displayed until the ingestion worker has processed a new entry
+PENDING_PORTRAIT = 'author_portraits/not_found.jpg'
+PENDING_COVER = 'covers/not_found.jpg'
+
+
+def enrich_author(author, wiki_data=None):
+    """
+    Fill in the Author attributes that have to be fetched from the Wiki API.
+
+    Set bio attribute to the summary of the Wiki page.
+    Attempt retrieving image data from Wiki API, if successful set it to portrait, otherwise use default.
+    Build the resized variants of the portrait.
+
+    :param author: Author object
+    :param wiki_data: Summary and image data already fetched by get_wiki_data, fetched here if not given
+    :return: List of the updated field names
+    """
+    author.bio, image_data = wiki_data or get_wiki_data([author.name])[author.name]
+    if image_data is None:
+        author.portrait = PENDING_PORTRAIT
+    else:
+        author.portrait.save(f'{author.name}.jpg', ContentFile(image_data), save=False)
+    author.image_variants = build_variants(author.portrait)
+    return ['bio', 'portrait', 'image_variants']
+
+
+def enrich_book(book, wiki_data=None):
+    """
+    Fill in the Book attributes that are derived from the Wiki API and the uploaded PDF.
+
+    Set description attribute to the summary of the Wiki page.
+    Read the uploaded PDF book to access data and set page_count to the total pages.
+    Obtain pixel map from the books first page to build cover image.
+    The PDF is skipped for books that already got both when imported.
+    Build the resized variants of the cover image.
+
+    :param book: Book object
+    :param wiki_data: Summary already fetched by get_wiki_data, fetched here if not given
+    :return: List of the updated field names
+    """
+    book.description = (wiki_data or get_wiki_data([book.title], images=False)[book.title])[0]
+    updated_fields = ['description', 'image_variants']
+    if book.page_count is None or book.cover_image.name == PENDING_COVER:
+        with book.pdf.open('rb') as pdf_file:
+            pdf_data = get_pdf_data(pdf_file)
+        book.page_count = pdf_data.page_count
+        image_data = convert_pdf_to_image(pdf_data, 0)
+        book.cover_image.save(f'{book.title}.jpg', ContentFile(image_data), save=False)
+        updated_fields += ['page_count', 'cover_image']
+    book.image_variants = build_variants(book.cover_image)
+    return updated_fields
+
+
+def hash_pdf_file(path):
+    """
+    Calculate the SHA-256 hash of a PDF file, used to recognise already imported books.
+
+    :param path: Path to the PDF file
+    :return: Tuple of the path and its hex digest, or None as digest if the file can't be read
+    """
+    digest = hashlib.sha256()
+    try:
+        with open(path, 'rb') as pdf_file:
+            for chunk in iter(lambda: pdf_file.read(1024 * 1024), b''):
+                digest.update(chunk)
+    except OSError:
+        return path, None
+    return path, digest.hexdigest()
+
+
+def read_pdf_file(path):
+    """
+    Obtain the page count and the cover image of a PDF file.
+    Module level so it can be run in worker processes.
+
+    :param path: Path to the PDF file
+    :return: Tuple of the path, page count and cover image data as bytes, or None for both if it isn't a readable PDF
+    """
+    try:
+        with open(path, 'rb') as pdf_file:
+            pdf_data = get_pdf_data(pdf_file)
+        return path, pdf_data.page_count, convert_pdf_to_image(pdf_data, 0)
+    except Exception:
+        return path, None, None
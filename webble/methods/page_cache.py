@@ -0,0 +1,108 @@
+import os
+import shutil
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+
+
+class PageCache:
+    """
+    Two level cache for rendered book pages.
+
+    Entries live in a size bounded in-memory LRU and are mirrored on disk under PAGE_CACHE_DIR,
+    so rendered pages survive restarts and are shared between worker processes.
+    Entries are keyed by book primary key, page index and a key of the render settings and PDF version used.
+    """
+
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _book_dir(book_pk):
+        return os.path.join(settings.PAGE_CACHE_DIR, str(book_pk))
+
+    def _path(self, key):
+        book_pk, page, render_key = key
+        return os.path.join(self._book_dir(book_pk), f'{page}-{render_key}')
+
+    def _remember(self, key, data):
+        """
+        Store data in the in-memory LRU, evicting the least recently used entries over the size limit.
+        Entries larger than the whole memory budget are only kept on disk.
+        """
+        if len(data) > settings.PAGE_CACHE_MEMORY_BYTES:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._size -= len(self._entries.pop(key))
+            self._entries[key] = data
+            self._size += len(data)
+            while self._size > settings.PAGE_CACHE_MEMORY_BYTES:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+
+    def get(self, book_pk, page, render_key):
+        """
+        Look the page up in memory first and fall back to the disk copy.
+
+        :param book_pk: Book primary key
+        :param page: Page index
+        :param render_key: Identifier of the render settings and PDF version used
+        :return: Cached data as bytes or None if not cached
+        """
+        key = (book_pk, page, render_key)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+        try:
+            with open(self._path(key), 'rb') as cached_file:
+                data = cached_file.read()
+        except FileNotFoundError:
+            return None
+        self._remember(key, data)
+        return data
+
+    def set(self, book_pk, page, render_key, data):
+        """
+        Store rendered data in memory and on disk.
+        The disk copy is written to a temporary file first so readers never see partial files.
+
+        :param book_pk: Book primary key
+        :param page: Page index
+        :param render_key: Identifier of the render settings and PDF version used
+        :param data: Rendered data as bytes
+        """
+        key = (book_pk, page, render_key)
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(temp_path, 'wb') as cached_file:
+            cached_file.write(data)
+        os.replace(temp_path, path)
+        self._remember(key, data)
+
+    def invalidate(self, book_pk):
+        """
+        Drop every cached page of the book, both from memory and disk.
+
+        :param book_pk: Book primary key
+        """
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == book_pk]:
+                self._size -= len(self._entries.pop(key))
+        shutil.rmtree(self._book_dir(book_pk), ignore_errors=True)
+
+    def clear(self):
+        """
+        Drop the in-memory entries. Disk copies are kept.
+        """
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+
+page_cache = PageCache()
@@ -0,0 +1,189 @@
+import base64
+import binascii
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from django.http import Http404
+
+
+def encode_cursor(direction, values):
+    """
+    Build an opaque cursor pointing after or before a row.
+
+    :param direction: 'after' or 'before'
+    :param values: Values of the row in the keyset ordering
+    :return: URL safe cursor string
+    """
+    return base64.urlsafe_b64encode(json.dumps([direction, values]).encode()).decode().rstrip('=')
+
+
+class InvalidCursor(ValueError):
+    """
+    Raised for cursors that weren't built by encode_cursor for the ordering.
+    """
+
+
+def get_ordering_field(queryset, name):
+    """
+    Find the model field or annotation the queryset is ordered by.
+
+    :param queryset: Paginated queryset
+    :param name: Field name of the ordering, without the '-' prefix
+    :return: Field object
+    """
+    if name == 'pk':
+        return queryset.model._meta.pk
+    if name in queryset.query.annotations:
+        return queryset.query.annotations[name].output_field
+    return queryset.model._meta.get_field(name)
+
+
+def decode_cursor(cursor, ordering, queryset):
+    """
+    Read a cursor built by encode_cursor. Every value is converted to the type of its ordering field,
+    so a forged cursor can't reach the database with values it can't compare.
+
+    :param cursor: Cursor string
+    :param ordering: Keyset ordering the cursor has to match
+    :param queryset: Paginated queryset, used to look the ordering fields up
+    :return: Tuple of the direction and the row values
+    :raises InvalidCursor: If the cursor is malformed
+    """
+    try:
+        direction, values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (binascii.Error, UnicodeDecodeError, ValueError, TypeError):
+        raise InvalidCursor('Invalid cursor')
+    if direction not in ('after', 'before') or not isinstance(values, list) or len(values) != len(ordering):
+        raise InvalidCursor('Invalid cursor')
+    try:
+        values = [get_ordering_field(queryset, field.lstrip('-')).to_python(value)
+                  for field, value in zip(ordering, values)]
+    except (ValidationError, TypeError, ValueError):
+        raise InvalidCursor('Invalid cursor')
+    if None in values:
+        raise InvalidCursor('Invalid cursor')
+    return direction, values
+
+
+def keyset_filter(ordering, values, before=False):
+    """
+    Build the condition matching the rows after (or before) a row in the keyset ordering,
+    e.g. title > v OR (title = v AND id > x) for ('title', 'pk').
+    The condition is led by a plain range on the first field, so the database can seek its index.
+
+    :param ordering: Field names, '-' prefixed for descending order
+    :param values: Values of the row
+    :param before: Match the rows before the row instead
+    :return: Q object
+    """
+    condition = None
+    for field, value in reversed(list(zip(ordering, values))):
+        name = field.lstrip('-')
+        lookup = 'lt' if field.startswith('-') != before else 'gt'
+        strict = Q(**{f'{name}__{lookup}': value})
+        condition = strict if condition is None else strict | (Q(**{name: value}) & condition)
+    first = ordering[0]
+    return Q(**{f'{first.lstrip("-")}__{"lte" if first.startswith("-") != before else "gte"}': values[0]}) & condition
+
+
+def reverse_ordering(ordering):
+    return [field[1:] if field.startswith('-') else f'-{field}' for field in ordering]
+
+
+class KeysetPage:
+    """
+    Page of keyset paginated rows, with cursors to the pages next to it instead of page numbers.
+    """
+
+    def __init__(self, object_list, cursor, next_cursor, previous_cursor):
+        self.object_list = object_list
+        self.cursor = cursor
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class KeysetPaginationMixin:
+    """
+    Keyset (cursor) pagination for ListView based views.
+
+    Pages are read with WHERE (ordering) > (last row) ... LIMIT instead of COUNT(*) and OFFSET,
+    so deep pages cost the same as the first one when the ordering is indexed.
+    The ordering must end with a unique field, e.g. ('title', 'pk'). The cursor is passed as ?cursor=.
+    With estimate_count the total number of rows is counted at most once per ESTIMATED_COUNT_TIMEOUT.
+    """
+    keyset_ordering = ('pk',)
+    estimate_count = False
+
+    def get_keyset_ordering(self):
+        return self.keyset_ordering
+
+    def paginate_queryset(self, queryset, page_size):
+        """
+        Replaces the numbered pagination of ListView.
+
+        :return: Tuple of the paginator (None), the page, its rows and whether there are other pages
+        """
+        ordering = list(self.get_keyset_ordering())
+        cursor = self.request.GET.get('cursor', '')
+        try:
+            direction, values = decode_cursor(cursor, ordering, queryset) if cursor else ('after', None)
+        except InvalidCursor:
+            raise Http404('Invalid cursor')
+        if direction == 'before':
+            rows = queryset.filter(keyset_filter(ordering, values, before=True))
+            rows = list(rows.order_by(*reverse_ordering(ordering))[:page_size + 1])
+            has_previous, has_next = len(rows) > page_size, True
+            rows = rows[:page_size][::-1]
+        else:
+            if values is not None:
+                queryset = queryset.filter(keyset_filter(ordering, values))
+            rows = list(queryset.order_by(*ordering)[:page_size + 1])
+            has_previous, has_next = values is not None, len(rows) > page_size
+            rows = rows[:page_size]
+        next_cursor = previous_cursor = None
+        if rows and has_next:
+            next_cursor = encode_cursor('after', self.get_row_values(rows[-1], ordering))
+        if rows and has_previous:
+            previous_cursor = encode_cursor('before', self.get_row_values(rows[0], ordering))
+        page = KeysetPage(rows, cursor, next_cursor, previous_cursor)
+        return None, page, rows, page.has_other_pages()
+
+    @staticmethod
+    def get_row_values(row, ordering):
+        return [getattr(row, field.lstrip('-')) for field in ordering]
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        if self.estimate_count:
+            context['estimated_count'] = get_estimated_count(self.get_queryset())
+        return context
+
+
+def get_estimated_count(queryset):
+    """
+    Count the rows of a queryset, reusing the count for ESTIMATED_COUNT_TIMEOUT seconds.
+
+    :param queryset: Queryset to count
+    :return: Number of rows, possibly slightly outdated
+    """
+    key = 'webble:count:' + hashlib.sha1(str(queryset.order_by().query).encode()).hexdigest()
+    return cache.get_or_set(key, queryset.count, settings.ESTIMATED_COUNT_TIMEOUT)
@@ -0,0 +1,70 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+from .document_pool import DocumentBusy
+from .helper import get_page_image
+
+logger = logging.getLogger(__name__)
+
+
+class PagePrefetcher:
+    """
+    Renders the pages following the one being read into the page cache in the background.
+
+    Work runs on a small thread pool and at most PAGE_PREFETCH_MAX_PENDING pages are queued or rendering
+    at any time. When the cap is reached new pages are simply skipped, so read-ahead never piles up
+    behind the pages readers are actually waiting for.
+    The pages ahead of a reader are rendered one after the other by a single worker, which gives up as soon as
+    the document is in use or awaited, so read-ahead never delays a reader waiting for a page of the same book.
+    Skipped pages are rendered when they are requested.
+    """
+
+    def __init__(self):
+        self._executor = None
+        self._pending = set()
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=settings.PAGE_PREFETCH_WORKERS,
+                                                    thread_name_prefix='page-prefetch')
+            return self._executor
+
+    def _render(self, book, pages, profile_name):
+        try:
+            for page in pages:
+                get_page_image(book, page, profile_name, blocking=False)
+        except DocumentBusy:
+            pass
+        except Exception:
+            logger.exception('Prefetching page %s of book %s failed', page, book.pk)
+        finally:
+            with self._lock:
+                self._pending.difference_update((book.pk, page, profile_name) for page in pages)
+
+    def schedule(self, book, page, profile_name=None):
+        """
+        Schedule rendering of the pages after the given page, up to PAGE_PREFETCH_DEPTH pages ahead.
+
+        :param book: Book object
+        :param page: Index of the page being read
+        :param profile_name: Name of the render profile the pages are read with
+        """
+        last_page = min(page + settings.PAGE_PREFETCH_DEPTH, (book.page_count or 0) - 1)
+        pages = []
+        with self._lock:
+            for next_page in range(page + 1, last_page + 1):
+                key = (book.pk, next_page, profile_name)
+                if key in self._pending or len(self._pending) >= settings.PAGE_PREFETCH_MAX_PENDING:
+                    continue
+                self._pending.add(key)
+                pages.append(next_page)
+        if pages:
+            self._get_executor().submit(self._render, book, pages, profile_name)
+
+
+page_prefetcher = PagePrefetcher()
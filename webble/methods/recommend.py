@@ -0,0 +1,70 @@
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import Count
+
+# Weight of every shared author, shared genre and shared reader in the similarity score
+AUTHOR_WEIGHT = 3.0
+GENRE_WEIGHT = 1.0
+READER_WEIGHT = 0.5
+
+# Number of recommendations stored per book
+RECOMMENDATIONS_PER_BOOK = 10
+
+
+def score_similar_books(book, progress_model):
+    """
+    Score the books related to the book through shared authors, shared genres and shared readers.
+
+    :param book: Book object
+    :param progress_model: ReadingProgress model, its rows tell which users read which books
+    :return: Counter mapping book primary keys to scores
+    """
+    book_model = type(book)
+    scores = Counter()
+    related = [
+        (book_model.authors.through.objects.filter(author__in=book.authors.all()), 'author', AUTHOR_WEIGHT),
+        (book_model.genres.through.objects.filter(genre__in=book.genres.all()), 'genre', GENRE_WEIGHT),
+        (progress_model.objects.filter(user__in=progress_model.objects.filter(book=book).values('user')),
+         'user', READER_WEIGHT),
+    ]
+    for queryset, shared, weight in related:
+        for row in queryset.exclude(book=book).values('book').annotate(shared=Count(shared, distinct=True)):
+            scores[row['book']] += row['shared'] * weight
+    return scores
+
+
+def rebuild_recommendations(book, recommendation_model, progress_model):
+    """
+    Replace the stored recommendations of the book with its best scored similar books.
+
+    :param book: Book object
+    :param recommendation_model: SimilarBook model
+    :param progress_model: ReadingProgress model
+    :return: List of primary keys of the recommended books
+    """
+    top = score_similar_books(book, progress_model).most_common(RECOMMENDATIONS_PER_BOOK)
+    with transaction.atomic():
+        recommendation_model.objects.filter(book=book).delete()
+        recommendation_model.objects.bulk_create(
+            [recommendation_model(book=book, similar_id=similar, score=score) for similar, score in top])
+    return [similar for similar, _ in top]
+
+
+def refresh_recommendations(book, recommendation_model, progress_model):
+    """
+    Rebuild the recommendations of the book and of the books it now recommends,
+    which are the ones most likely to rank the book differently after a change.
+
+    :param book: Book object
+    :param recommendation_model: SimilarBook model
+    :param progress_model: ReadingProgress model
+    :return: List of primary keys of the rebuilt books
+    """
+    book_model = type(book)
+    rebuilt = [book.pk]
+    for similar in book_model.objects.filter(pk__in=rebuild_recommendations(book, recommendation_model,
+                                                                            progress_model)):
+        rebuild_recommendations(similar, recommendation_model, progress_model)
+        rebuilt.append(similar.pk)
+    return rebuilt
@@ -0,0 +1,57 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+
+class RenderQueueFull(Exception):
+    """
+    Raised when the render executor already holds as many jobs as it accepts.
+    """
+
+
+class RenderExecutor:
+    """
+    Bounded thread pool the async reader views offload PyMuPDF rendering to, keeping the event loop free.
+
+    At most PAGE_RENDER_WORKERS pages render at once and PAGE_RENDER_MAX_PENDING more may wait for a thread.
+    Further jobs are refused with RenderQueueFull, so a burst of readers can't pile up unbounded work
+    behind a single ASGI worker.
+    """
+
+    def __init__(self):
+        self._executor = None
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=settings.PAGE_RENDER_WORKERS,
+                                                    thread_name_prefix='page-render')
+            return self._executor
+
+    def _call(self, func, args):
+        try:
+            return func(*args)
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    async def run(self, func, *args):
+        """
+        Run the function on the pool and wait for its result without blocking the event loop.
+
+        :param func: Blocking function, e.g. get_page_image
+        :param args: Positional arguments of the function
+        :return: Return value of the function
+        """
+        with self._lock:
+            if self._pending >= settings.PAGE_RENDER_WORKERS + settings.PAGE_RENDER_MAX_PENDING:
+                raise RenderQueueFull()
+            self._pending += 1
+        return await asyncio.get_running_loop().run_in_executor(self._get_executor(), self._call, func, args)
+
+
+render_executor = RenderExecutor()
@@ -0,0 +1,58 @@
+import hashlib
+
+from django.conf import settings
+from django.contrib.messages import get_messages
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils.cache import patch_vary_headers
+
+from .catalogue import get_cache_versions
+
+
+class CachedPageMixin:
+    """
+    Serves GET responses to anonymous visitors from the cache and exposes the cache versions to templates,
+    so logged-in pages can cache their shared fragments.
+
+    Pages are cached under the versions of the scopes listed in cache_scopes, formatted with the URL kwargs,
+    e.g. 'book:{pk}'. Saving or deleting the shown entries bumps those versions, see webble.signals.
+    Responses vary on the Cookie header, so shared caches never mix anonymous and logged-in pages.
+    """
+    cache_scopes = ('catalogue',)
+
+    def get_cache_versions(self):
+        """
+        :return: Dictionary mapping the cache scopes of the page to their current versions
+        """
+        if not hasattr(self, '_cache_versions'):
+            self._cache_versions = get_cache_versions([scope.format(**self.kwargs) for scope in self.cache_scopes])
+        return self._cache_versions
+
+    def get_context_data(self, **kwargs):
+        """
+        Add the cache versions, keyed by the scope name before the colon, and the fragment timeout.
+        """
+        context = super().get_context_data(**kwargs)
+        context['cache_versions'] = {name.split(':')[0]: version for name, version in self.get_cache_versions().items()}
+        context['fragment_timeout'] = settings.FRAGMENT_CACHE_TIMEOUT
+        return context
+
+    def get(self, request, *args, **kwargs):
+        """
+        Answer anonymous visitors without pending messages from the cache, render and store the page otherwise.
+        """
+        if request.user.is_authenticated or len(get_messages(request)):
+            response = super().get(request, *args, **kwargs)
+        else:
+            versions = '|'.join(self.get_cache_versions().values())
+            key = 'webble:response:' + hashlib.sha1(f'{request.get_full_path()}|{versions}'.encode()).hexdigest()
+            content = cache.get(key)
+            if content is not None:
+                response = HttpResponse(content)
+            else:
+                response = super().get(request, *args, **kwargs)
+                response.render()
+                if response.status_code == 200:
+                    cache.set(key, response.content, settings.RESPONSE_CACHE_TIMEOUT)
+        patch_vary_headers(response, ('Cookie',))
+        return response
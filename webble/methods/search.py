@@ -0,0 +1,176 @@
+import re
+
+from django.db import connection, OperationalError
+from django.db.models import Q
+
+from .document_pool import document_pool
+from .text_layer import page_to_html, is_image_heavy
+
+# SQLite FTS5 table holding book metadata, author names and bios and the text of every book page
+SEARCH_TABLE = 'webble_search'
+CREATE_SEARCH_TABLE = f'''
+    CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5(
+        kind UNINDEXED, object_id UNINDEXED, page UNINDEXED, title, body, tokenize = 'porter unicode61'
+    )
+'''
+INSERT_SEARCH_ROW = f'INSERT INTO {SEARCH_TABLE} (kind, object_id, page, title, body) VALUES (%s, %s, %s, %s, %s)'
+
+# Whether the FTS5 table exists, per database name. Cleared on post_migrate, which may create it.
+_fts_tables = {}
+
+# Kinds of indexed rows
+BOOK = 'book'
+AUTHOR = 'author'
+PAGE = 'page'
+
+
+def create_search_table(**kwargs):
+    """
+    Create the FTS5 table on SQLite databases. Connected to post_migrate.
+    Other backends, or SQLite builds without FTS5, use the fallback search instead.
+    """
+    _fts_tables.clear()
+    if connection.vendor != 'sqlite':
+        return
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(CREATE_SEARCH_TABLE)
+    except OperationalError:
+        pass
+
+
+def fts_available():
+    """
+    Check if the FTS5 table exists on the default database.
+    The answer is remembered per database, so searches and index updates don't list the tables every time.
+
+    :return: True if the FTS5 table can be used
+    """
+    if connection.vendor != 'sqlite':
+        return False
+    name = connection.settings_dict['NAME']
+    if name not in _fts_tables:
+        _fts_tables[name] = SEARCH_TABLE in connection.introspection.table_names()
+    return _fts_tables[name]
+
+
+def index_entry(kind, object_id, title, body, page=None):
+    """
+    Replace the indexed row of a book, author or book page.
+
+    :param kind: BOOK, AUTHOR or PAGE
+    :param object_id: Primary key of the book or author
+    :param title: Indexed title, the book title or the author name
+    :param body: Indexed body, the description, bio or page text
+    :param page: Page number for PAGE rows
+    """
+    if not fts_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {SEARCH_TABLE} WHERE kind = %s AND object_id = %s AND page IS %s',
+                       [kind, object_id, page])
+        cursor.execute(INSERT_SEARCH_ROW, [kind, object_id, page, title, body or ''])
+
+
+def index_pages(book, page_texts):
+    """
+    Replace the indexed pages of a book. Page rows only index the page text, so title matches
+    are reported once as book results rather than for every page.
+
+    :param book: Book object
+    :param page_texts: List of (page number, text) tuples
+    """
+    if not fts_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {SEARCH_TABLE} WHERE kind = %s AND object_id = %s', [PAGE, book.pk])
+        cursor.executemany(INSERT_SEARCH_ROW, [[PAGE, book.pk, page, '', text] for page, text in page_texts])
+
+
+def index_book_pages(book):
+    """
+    Extract the text and the text mode HTML of every page of the book, store them and index the text.
+    Pages that are mostly images are flagged, so the text mode shows them rendered.
+
+    :param book: Book object
+    """
+    page_model = book.pagetext_set.model
+    pages = []
+    with document_pool.document(book) as pdf_data:
+        for number, page in enumerate(pdf_data):
+            text = page.get_text()
+            pages.append(page_model(book=book, page=number + 1, text=text, html=page_to_html(page),
+                                    image_heavy=is_image_heavy(page, text)))
+    book.pagetext_set.all().delete()
+    page_model.objects.bulk_create(pages)
+    index_pages(book, [(page.page, page.text) for page in pages])
+
+
+def remove_entries(kind, object_id):
+    """
+    Remove the indexed rows of a deleted book or author, including the pages of a book.
+
+    :param kind: BOOK or AUTHOR
+    :param object_id: Primary key of the book or author
+    """
+    if not fts_available():
+        return
+    kinds = [BOOK, PAGE] if kind == BOOK else [kind]
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {SEARCH_TABLE} WHERE kind IN ({", ".join(["%s"] * len(kinds))}) '
+                       f'AND object_id = %s', [*kinds, object_id])
+
+
+def build_match_query(phrase):
+    """
+    Turn the searched phrase into an FTS5 query. Every word is quoted, so user input can't inject
+    FTS5 syntax, and matched as a prefix, so partially typed words still find results.
+
+    :param phrase: Searched phrase
+    :return: FTS5 query or None if the phrase has no words
+    """
+    words = re.findall(r'\w+', phrase or '')
+    return ' '.join(f'"{word}"*' for word in words) or None
+
+
+def search(phrase, book_model, author_model, page_model, limit=18):
+    """
+    Find books, authors and book pages matching the phrase, best matches first.
+    Titles and names weigh ten times more than descriptions, bios and page text.
+
+    :param phrase: Searched phrase
+    :param book_model: Book model
+    :param author_model: Author model
+    :param page_model: PageText model, used by the fallback search
+    :param limit: Maximum number of results of every kind
+    :return: Tuple of lists of Book objects, Author objects and (Book object, page number, snippet) tuples
+    """
+    query = build_match_query(phrase)
+    if query is None:
+        return [], [], []
+    if not fts_available():
+        return fallback_search(phrase, book_model, author_model, page_model, limit)
+    hits = {BOOK: [], AUTHOR: [], PAGE: []}
+    with connection.cursor() as cursor:
+        for kind in hits:
+            cursor.execute(f'SELECT object_id, page, snippet({SEARCH_TABLE}, 4, \'\', \'\', \'...\', 12) '
+                           f'FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s AND kind = %s '
+                           f'ORDER BY bm25({SEARCH_TABLE}, 0, 0, 0, 10.0, 1.0) LIMIT %s', [query, kind, limit])
+            hits[kind] = cursor.fetchall()
+    books = book_model.objects.in_bulk({int(hit[0]) for hit in hits[BOOK] + hits[PAGE]})
+    authors = author_model.objects.in_bulk([int(hit[0]) for hit in hits[AUTHOR]])
+    return ([books[int(hit[0])] for hit in hits[BOOK] if int(hit[0]) in books],
+            [authors[int(hit[0])] for hit in hits[AUTHOR] if int(hit[0]) in authors],
+            [(books[int(hit[0])], hit[1], hit[2]) for hit in hits[PAGE] if int(hit[0]) in books])
+
+
+def fallback_search(phrase, book_model, author_model, page_model, limit):
+    """
+    Search with plain database lookups, for backends without the FTS5 table.
+
+    :return: Same as search, with the start of the page text as snippet
+    """
+    books = book_model.objects.filter(Q(title__icontains=phrase) | Q(description__icontains=phrase))[:limit]
+    authors = author_model.objects.filter(Q(name__icontains=phrase) | Q(bio__icontains=phrase))[:limit]
+    pages = page_model.objects.filter(text__icontains=phrase).select_related('book')[:limit]
+    return list(books), list(authors), [(page.book, page.page, page.text[:100]) for page in pages]
@@ -0,0 +1,65 @@
+import statistics
+
+import fitz
+from django.conf import settings
+from django.utils.html import escape
+
+# Span flags set by PyMuPDF for bold and italic fonts
+BOLD = fitz.TEXT_FONT_BOLD
+ITALIC = fitz.TEXT_FONT_ITALIC
+
+
+def span_to_html(span):
+    """
+    Escape the text of a span and wrap it in the tags of its font style.
+
+    :param span: Span dictionary of get_text('dict')
+    :return: HTML string
+    """
+    html = escape(span['text'])
+    if span['flags'] & BOLD:
+        html = f'<b>{html}</b>'
+    if span['flags'] & ITALIC:
+        html = f'<i>{html}</i>'
+    return html
+
+
+def page_to_html(page):
+    """
+    Convert the text layer of a PDF page into lightweight HTML.
+    Every text block becomes a paragraph, blocks set noticeably larger than the body text become headings.
+    The text is escaped, so the HTML of any PDF is safe to display.
+
+    :param page: PyMuPDF page
+    :return: HTML string
+    """
+    blocks = [block for block in page.get_text('dict', flags=fitz.TEXTFLAGS_TEXT)['blocks'] if block['type'] == 0]
+    sizes = [span['size'] for block in blocks for line in block['lines'] for span in line['spans']]
+    if not sizes:
+        return ''
+    body_size = statistics.median(sizes)
+    html = []
+    for block in blocks:
+        lines = [''.join(span_to_html(span) for span in line['spans']) for line in block['lines']]
+        text = ' '.join(line for line in lines if line.strip())
+        if not text:
+            continue
+        block_size = max(span['size'] for line in block['lines'] for span in line['spans'])
+        tag = 'h4' if block_size >= body_size * 1.25 else 'p'
+        html.append(f'<{tag}>{text}</{tag}>')
+    return '\n'.join(html)
+
+
+def is_image_heavy(page, text):
+    """
+    Check if a page has to be shown rendered because its content is mostly images,
+    e.g. scanned pages without text, illustrations or photos.
+
+    :param page: PyMuPDF page
+    :param text: Extracted text of the page
+    :return: True if the page should not be shown as text
+    """
+    if not text.strip():
+        return True
+    image_area = sum(abs(fitz.Rect(image['bbox']) & page.rect) for image in page.get_image_info())
+    return image_area / abs(page.rect) >= settings.READER_IMAGE_PAGE_COVERAGE
@@ -0,0 +1,120 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import closing
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from .contants import HEADER
+
+
+class ResponseCache:
+    """
+    Persistent SQLite cache of Wiki responses with a time to live.
+    A connection is opened per call, so the cache can be shared by threads and worker processes.
+    """
+
+    def __init__(self, path, ttl):
+        self.path = path
+        self.ttl = ttl
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with closing(sqlite3.connect(self.path)) as connection, connection:
+            connection.execute('CREATE TABLE IF NOT EXISTS response (key TEXT PRIMARY KEY, expires REAL, value BLOB)')
+
+    def get(self, key):
+        with closing(sqlite3.connect(self.path, timeout=10)) as connection, connection:
+            row = connection.execute('SELECT value FROM response WHERE key = ? AND expires > ?',
+                                     (key, time.time())).fetchone()
+        return row[0] if row else None
+
+    def set(self, key, value):
+        with closing(sqlite3.connect(self.path, timeout=10)) as connection, connection:
+            connection.execute('INSERT OR REPLACE INTO response VALUES (?, ?, ?)',
+                               (key, time.time() + self.ttl, value))
+
+
+class WikiClient:
+    """
+    Shared HTTP client for the Wiki enrichment helpers.
+
+    Connections are pooled in a single session, every request has a timeout and failed requests
+    are retried a bounded number of times with exponential backoff.
+    Responses are kept in a persistent cache, so repeated lookups never hit the network.
+    The API endpoint is read from WIKI_API_URL, which lets tests point the client to a local stub server.
+    """
+
+    def __init__(self):
+        self._session = None
+        self._cache = None
+        self._lock = threading.Lock()
+
+    @property
+    def session(self):
+        with self._lock:
+            if self._session is None:
+                retry = Retry(total=settings.WIKI_MAX_RETRIES, backoff_factor=settings.WIKI_RETRY_BACKOFF,
+                              status_forcelist=(429, 500, 502, 503, 504), allowed_methods=('GET',))
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=settings.WIKI_POOL_SIZE, max_retries=retry)
+                self._session = requests.Session()
+                self._session.headers.update(HEADER)
+                self._session.mount('http://', adapter)
+                self._session.mount('https://', adapter)
+            return self._session
+
+    @property
+    def cache(self):
+        # Reopened when WIKI_CACHE_PATH changes, e.g. when tests point it to a temporary file
+        with self._lock:
+            path = settings.WIKI_CACHE_PATH
+            if not path:
+                return None
+            if self._cache is None or self._cache.path != path:
+                self._cache = ResponseCache(path, settings.WIKI_CACHE_TTL)
+            return self._cache
+
+    def _fetch(self, url, params=None):
+        """
+        Fetch the response body, from the cache when possible.
+
+        :param url: Requested URL
+        :param params: Query parameters
+        :return: Response content as bytes
+        """
+        key = hashlib.sha256(json.dumps([url, params], sort_keys=True).encode()).hexdigest()
+        cache = self.cache
+        if cache is not None:
+            content = cache.get(key)
+            if content is not None:
+                return content
+        response = self.session.get(url, params=params, timeout=settings.WIKI_TIMEOUT)
+        response.raise_for_status()
+        if cache is not None:
+            cache.set(key, response.content)
+        return response.content
+
+    def query(self, params):
+        """
+        Run a query against the Wiki API.
+
+        :param params: Query parameters
+        :return: Decoded JSON response
+        """
+        return json.loads(self._fetch(settings.WIKI_API_URL, params))
+
+    def download(self, url):
+        """
+        Download a file, such as an image found through the API.
+
+        :param url: File URL
+        :return: File content as bytes
+        """
+        return self._fetch(url)
+
+
+wiki_client = WikiClient()
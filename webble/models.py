@@ -1,31 +1,60 @@
-from django.core.files.base import ContentFile
-from django.db import models
+import logging
+import random
+from datetime import timedelta
 
-from .methods.helper import get_image_data, get_summary, convert_pdf_to_image, get_pdf_data
+from django.apps import apps
+from django.conf import settings
+from django.db import models, transaction
+from django.utils import timezone
+
+from .methods.catalogue import bump_cache_versions
+from .methods.document_pool import document_pool
+from .methods.helper import get_wiki_data
+from .methods.ingest import enrich_author, enrich_book, PENDING_COVER, PENDING_PORTRAIT
+from .methods.page_cache import page_cache
+from .methods.recommend import rebuild_recommendations, refresh_recommendations
+from .methods.search import index_book_pages, index_pages
+
+logger = logging.getLogger(__name__)
+
+# Ingestion states of Author and Book entries
+PENDING = 'pending'
+READY = 'ready'
+FAILED = 'failed'
+STATUS_CHOICES = [(PENDING, 'Pending'), (READY, 'Ready'), (FAILED, 'Failed')]
+
+
+def get_random_key():
+    return random.random()
 
 
 class Author(models.Model):
     name = models.CharField(max_length=60)
     bio = models.TextField(null=True, blank=True)
     portrait = models.ImageField(upload_to='author_portraits/', blank=True, null=True,)
+    # Resized copies of the portrait, built by the ingestion worker
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=READY, editable=False)
 
     def save(self, *args, **kwargs):
         """
         Overwriting the save method.
 
         Check if new entry is being created not updated.
-        Set bio attribute to string fetched by get_summary function.
-        Attempt retrieving image data from Wiki API, if successful set it to portrait, otherwise use default.
+        New entries are saved with a pending status and placeholder portrait,
+        the Wiki bio and portrait are fetched by the ingestion worker afterwards.
         Save the attributes and invoke the parent save method.
         """
-        if not self.pk:
-            self.bio = get_summary(self.name)
-            image_data = get_image_data(self.name)
-            if image_data is None:
-                self.portrait = 'author_portraits/not_found.jpg'
-            else:
-                self.portrait.save(f'{self.name}.jpg', ContentFile(image_data), save=False)
+        created = not self.pk
+        if created:
+            self.status = PENDING
+            self.portrait = PENDING_PORTRAIT
         super().save(*args, **kwargs)
+        if created:
+            IngestJob.enqueue(author=self)
+
+    class Meta:
+        indexes = [models.Index(fields=['name'], name='webble_author_name_idx')]
 
     def __str__(self):
         return f'{self.name}'
@@ -33,20 +62,64 @@ class Author(models.Model):
 
 class Genre(models.Model):
     genre = models.CharField(max_length=20)
+    # Random sort key, used to pick random rows without shuffling the table. Refreshed by the shuffle command.
+    random_key = models.FloatField(default=get_random_key, db_index=True, editable=False)
 
     def __str__(self):
         return f'{self.genre}'
 
 
+class BookQuerySet(models.QuerySet):
+    """
+    Queryset of books, able to load the authors and genres of all books with one query each.
+    """
+
+    def with_relations(self):
+        return self.prefetch_related('authors', 'genres')
+
+
 class Book(models.Model):
     title = models.CharField(max_length=60)
     authors = models.ManyToManyField(Author)
     genres = models.ManyToManyField(Genre)
     pdf = models.FileField(upload_to='books/')
     cover_image = models.ImageField(upload_to='covers/', blank=True)
+    # Resized copies of the cover image, built by the ingestion worker
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
     publish_date = models.DateField(null=True, blank=True)
     description = models.TextField(null=True, blank=True)
     page_count = models.IntegerField(null=True, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=READY, editable=False)
+    file_hash = models.CharField(max_length=64, unique=True, null=True, blank=True, editable=False)
+    # Random sort key, used to pick random rows without shuffling the table. Refreshed by the shuffle command.
+    random_key = models.FloatField(default=get_random_key, db_index=True, editable=False)
+    # Review rating aggregates, maintained by the review views and recomputed by the repair_ratings command
+    rating_sum = models.IntegerField(default=0, editable=False)
+    rating_count = models.IntegerField(default=0, editable=False)
+    rating_count_1 = models.IntegerField(default=0, editable=False)
+    rating_count_2 = models.IntegerField(default=0, editable=False)
+    rating_count_3 = models.IntegerField(default=0, editable=False)
+    rating_count_4 = models.IntegerField(default=0, editable=False)
+    rating_count_5 = models.IntegerField(default=0, editable=False)
+
+    objects = BookQuerySet.as_manager()
+
+    class Meta:
+        indexes = [models.Index(fields=['title'], name='webble_book_title_idx')]
+
+    @property
+    def rating(self):
+        """
+        Average review rating or None if the book has no reviews.
+        """
+        return self.rating_sum / self.rating_count if self.rating_count else None
+
+    @property
+    def rating_histogram(self):
+        """
+        List of (rating, number of reviews) tuples from 5 stars down to 1.
+        """
+        return [(rating, getattr(self, f'rating_count_{rating}')) for rating in range(5, 0, -1)]
 
     # Overwriting the save method.
     def save(self, *args, **kwargs):
@@ -54,22 +127,243 @@ class Book(models.Model):
         Overwriting the save method.
 
         Check if new entry is being created not updated.
-        Set description attribute to string fetched by get_summary function.
-        Read the uploaded PDF book to access data and set page_count to the total pages.
-        Obtain pixel map from the books specified page to build cover image.
+        New entries are saved with a pending status and placeholder cover,
+        the description, page count and cover image are filled in by the ingestion worker afterwards.
+        If an existing entry gets a different PDF, drop its cached pages, pooled document and page text,
+        and queue it for the ingestion worker again, which rebuilds them from the new PDF.
         Save the attributes and invoke the parent save method.
         """
         # Check if new entry is being created or updated
-        if not self.pk:
-            self.description = get_summary(self.title)
-            # Open the uploaded PDF file and get the page count
-            pdf_data = get_pdf_data(self.pdf)
-            self.page_count = pdf_data.page_count
-            # Generate the cover image from the first page of the PDF
-            image_data = convert_pdf_to_image(pdf_data, 0)
-            # Assign the cover image in the cover_image field
-            self.cover_image.save(f'{self.title}.jpg', ContentFile(image_data), save=False)
+        created = not self.pk
+        replaced = not created and Book.objects.filter(pk=self.pk).exclude(pdf=self.pdf.name).exists()
+        if created or replaced:
+            self.status = PENDING
+            self.cover_image = PENDING_COVER
+        if replaced:
+            page_cache.invalidate(self.pk)
+            document_pool.discard(self.pk)
+            self.pagetext_set.all().delete()
+            index_pages(self, [])
         super().save(*args, **kwargs)
+        if created or replaced:
+            IngestJob.enqueue(book=self)
+
+    def delete(self, *args, **kwargs):
+        page_cache.invalidate(self.pk)
+        document_pool.discard(self.pk)
+        return super().delete(*args, **kwargs)
 
     def __str__(self):
         return f'{self.title}'
+
+
+class SimilarBook(models.Model):
+    """
+    Precomputed recommendation, a book similar to the book through shared authors, genres and readers.
+    """
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='recommendations')
+    similar = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='+')
+    score = models.FloatField()
+
+    class Meta:
+        ordering = ['-score']
+        unique_together = ('book', 'similar',)
+        indexes = [models.Index(fields=['book', '-score'])]
+
+
+class RecommendationJob(models.Model):
+    """
+    Queued rebuild of the recommendations of a book, processed by the ingest_worker command.
+    New readers and changed authors or genres only queue the book, so scoring never runs inside a request.
+    Without INGEST_ASYNC the queue is processed right after the saving transaction commits instead.
+    """
+    book = models.OneToOneField(Book, on_delete=models.CASCADE)
+    # Also rebuild the books it recommends, which may rank it differently after its authors or genres changed
+    refresh_similar = models.BooleanField(default=False)
+
+    @classmethod
+    def enqueue(cls, book_pks, refresh_similar=False):
+        """
+        Queue the books, books already queued are not queued twice.
+
+        :param book_pks: Primary keys of the books
+        :param refresh_similar: Also rebuild the books they recommend
+        """
+        cls.objects.bulk_create([cls(book_id=pk, refresh_similar=refresh_similar) for pk in book_pks],
+                                ignore_conflicts=True)
+        if refresh_similar:
+            cls.objects.filter(book_id__in=book_pks, refresh_similar=False).update(refresh_similar=True)
+        if not settings.INGEST_ASYNC:
+            transaction.on_commit(cls.run_pending)
+
+    @classmethod
+    def run_pending(cls, limit=None):
+        """
+        Rebuild the recommendations of the queued books and drop the cached pages showing them.
+        Jobs are claimed by deleting them, so several workers never rebuild the same book.
+
+        :param limit: Maximum number of jobs
+        :return: Number of processed jobs
+        """
+        progress_model = apps.get_model('user', 'ReadingProgress')
+        processed, rebuilt = 0, set()
+        for job in cls.objects.select_related('book').order_by('pk')[:limit]:
+            if not cls.objects.filter(pk=job.pk).delete()[0]:
+                continue
+            processed += 1
+            try:
+                if job.refresh_similar:
+                    rebuilt.update(refresh_recommendations(job.book, SimilarBook, progress_model))
+                else:
+                    rebuild_recommendations(job.book, SimilarBook, progress_model)
+                    rebuilt.add(job.book_id)
+            except Exception:
+                logger.exception('Rebuilding the recommendations of book %s failed', job.book_id)
+        if rebuilt:
+            transaction.on_commit(lambda: bump_cache_versions(*(f'book:{pk}' for pk in rebuilt)))
+        return processed
+
+
+class PageText(models.Model):
+    """
+    Text extracted from a book page, used by search and the text reading mode.
+    """
+    book = models.ForeignKey(Book, on_delete=models.CASCADE)
+    page = models.IntegerField()
+    text = models.TextField(blank=True)
+    html = models.TextField(blank=True)
+    # Mostly images, shown rendered in the text reading mode as well
+    image_heavy = models.BooleanField(default=False)
+
+    class Meta:
+        ordering = ['page']
+        unique_together = ('book', 'page',)
+
+
+class IngestJob(models.Model):
+    """
+    Queued enrichment of a new Author or Book, processed by the ingest_worker management command.
+    Failed jobs are retried with exponential backoff until INGEST_MAX_ATTEMPTS is reached.
+    Claimed jobs hold a lease of INGEST_LEASE seconds, jobs of a worker that died are claimed again once it expires.
+    """
+    RUNNING = 'running'
+    DONE = 'done'
+    JOB_STATUS_CHOICES = [(PENDING, 'Pending'), (RUNNING, 'Running'), (DONE, 'Done'), (FAILED, 'Failed')]
+
+    author = models.ForeignKey(Author, on_delete=models.CASCADE, null=True, blank=True)
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, null=True, blank=True)
+    status = models.CharField(max_length=10, choices=JOB_STATUS_CHOICES, default=PENDING)
+    attempts = models.IntegerField(default=0)
+    run_after = models.DateTimeField(default=timezone.now)
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['run_after']
+        indexes = [models.Index(fields=['status', 'run_after'])]
+
+    @classmethod
+    def enqueue(cls, author=None, book=None):
+        """
+        Create a job for the entry. Without INGEST_ASYNC the job is run as soon as the transaction commits.
+
+        :param author: Author object
+        :param book: Book object
+        :return: IngestJob object
+        """
+        job = cls.objects.create(author=author, book=book)
+        if not settings.INGEST_ASYNC:
+            transaction.on_commit(job.run)
+        return job
+
+    @classmethod
+    def claim_next(cls):
+        """
+        Claim the oldest due pending job, or a running job whose lease expired.
+        The lost run of an expired job counts as an attempt, jobs out of attempts are failed instead.
+        The claim is a conditional UPDATE, so several workers can poll the same table safely.
+
+        :return: IngestJob object or None if there is nothing to do
+        """
+        now = timezone.now()
+        expired = models.Q(status=cls.RUNNING, claimed_at__lt=now - timedelta(seconds=settings.INGEST_LEASE))
+        for job in cls.objects.filter(models.Q(status=PENDING, run_after__lte=now) | expired)[:10]:
+            changes = {'status': cls.RUNNING, 'claimed_at': now}
+            if job.status == cls.RUNNING:
+                job.attempts += 1
+                changes['attempts'] = job.attempts
+                if job.attempts >= settings.INGEST_MAX_ATTEMPTS:
+                    changes.update(status=FAILED, last_error='Lease expired')
+            if not cls.objects.filter(pk=job.pk, status=job.status, claimed_at=job.claimed_at).update(**changes):
+                continue
+            if changes['status'] == FAILED:
+                entry = job.author or job.book
+                type(entry).objects.filter(pk=entry.pk).update(status=FAILED)
+                continue
+            job.status, job.claimed_at = cls.RUNNING, now
+            return job
+        return None
+
+    @classmethod
+    def claim_batch(cls, size):
+        """
+        Claim up to size due pending jobs.
+
+        :param size: Maximum number of jobs
+        :return: List of IngestJob objects
+        """
+        jobs = []
+        while len(jobs) < size:
+            job = cls.claim_next()
+            if job is None:
+                break
+            jobs.append(job)
+        return jobs
+
+    @classmethod
+    def run_batch(cls, jobs):
+        """
+        Run several jobs, fetching the Wiki data of all their entries with batched requests first.
+        If the batched lookup fails, every job falls back to its own lookup and retry handling.
+
+        :param jobs: List of IngestJob objects
+        """
+        try:
+            author_data = get_wiki_data([job.author.name for job in jobs if job.author])
+            book_data = get_wiki_data([job.book.title for job in jobs if job.book], images=False)
+        except Exception:
+            author_data, book_data = {}, {}
+        for job in jobs:
+            job.run(author_data.get(job.author.name) if job.author else book_data.get(job.book.title))
+
+    def run(self, wiki_data=None):
+        """
+        Enrich the entry of the job and mark it ready.
+        On failure the job is rescheduled, or the entry marked failed once out of attempts.
+
+        :param wiki_data: Wiki data of the entry already fetched by get_wiki_data
+        """
+        entry = self.author or self.book
+        self.attempts += 1
+        try:
+            updated_fields = enrich_author(entry, wiki_data) if self.author else enrich_book(entry, wiki_data)
+            if self.book:
+                index_book_pages(entry)
+            entry.status = READY
+            entry.save(update_fields=updated_fields + ['status'])
+            self.status = self.DONE
+            self.last_error = ''
+        except Exception as error:
+            self.last_error = repr(error)
+            if self.attempts < settings.INGEST_MAX_ATTEMPTS:
+                self.status = PENDING
+                delay = settings.INGEST_RETRY_DELAY * 2 ** (self.attempts - 1)
+                self.run_after = timezone.now() + timedelta(seconds=delay)
+            else:
+                self.status = FAILED
+                type(entry).objects.filter(pk=entry.pk).update(status=FAILED)
+        self.save()
+
+    def __str__(self):
+        return f'{self.author or self.book} ({self.status})'
@@ -0,0 +1,78 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+
+from user.models import ReadingProgress, Review
+from .methods.catalogue import invalidate_genre_catalogue, bump_cache_versions
+from .methods.search import index_entry, remove_entries, BOOK, AUTHOR
+from .models import Book, Author, Genre, RecommendationJob
+
+
+# Keep the search index in step with book and author changes.
+@receiver(post_save, sender=Book)
+def index_book(sender, instance, **kwargs):
+    index_entry(BOOK, instance.pk, instance.title, instance.description)
+
+
+@receiver(post_save, sender=Author)
+def index_author(sender, instance, **kwargs):
+    index_entry(AUTHOR, instance.pk, instance.name, instance.bio)
+
+
+@receiver(post_delete, sender=Book)
+def unindex_book(sender, instance, **kwargs):
+    remove_entries(BOOK, instance.pk)
+
+
+@receiver(post_delete, sender=Author)
+def unindex_author(sender, instance, **kwargs):
+    remove_entries(AUTHOR, instance.pk)
+
+
+# Make every process reload its navbar genres.
+@receiver(post_save, sender=Genre)
+@receiver(post_delete, sender=Genre)
+def genres_changed(sender, **kwargs):
+    invalidate_genre_catalogue()
+
+
+# Drop the cached catalogue pages and fragments showing the changed entries.
+# Versions are bumped once the change is committed, a request rendering the old rows in the meantime
+# would otherwise cache them under the new version.
+@receiver(post_save, sender=Book)
+@receiver(post_delete, sender=Book)
+@receiver(post_save, sender=Author)
+@receiver(post_delete, sender=Author)
+@receiver(post_save, sender=Genre)
+@receiver(post_delete, sender=Genre)
+@receiver(m2m_changed, sender=Book.authors.through)
+@receiver(m2m_changed, sender=Book.genres.through)
+def catalogue_changed(sender, **kwargs):
+    transaction.on_commit(lambda: bump_cache_versions('catalogue'))
+
+
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+def reviews_changed(sender, instance, **kwargs):
+    transaction.on_commit(lambda: bump_cache_versions('ratings', f'book:{instance.book_id}'))
+
+
+# Queue the recommendations of a book for rebuilding when its authors, genres or readers change.
+# Edits from the Author or Genre side are reverse changes listing the affected books in pk_set,
+# clearing them is caught before the relations are gone.
+@receiver(m2m_changed, sender=Book.authors.through)
+@receiver(m2m_changed, sender=Book.genres.through)
+def book_relations_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            RecommendationJob.enqueue([instance.pk], refresh_similar=True)
+    elif action in ('post_add', 'post_remove'):
+        RecommendationJob.enqueue(pk_set, refresh_similar=True)
+    elif action == 'pre_clear':
+        RecommendationJob.enqueue(list(instance.book_set.values_list('pk', flat=True)), refresh_similar=True)
+
+
+@receiver(post_save, sender=ReadingProgress)
+def book_reader_added(sender, instance, created, **kwargs):
+    if created:
+        RecommendationJob.enqueue([instance.book_id])
@@ -0,0 +1,37 @@
+from django import template
+from django.forms.utils import flatatt
+from django.utils.html import format_html
+
+register = template.Library()
+
+
+def get_srcset(storage, variants):
+    return ', '.join(f'{storage.url(name)} {width}w' for width, name in variants)
+
+
+@register.simple_tag
+def responsive_image(image, variants, sizes='160px', **attributes):
+    """
+    Render a picture element offering the stored WebP and JPEG variants of the image,
+    so browsers download the smallest file fitting the displayed size.
+    Images without up-to-date variants are rendered as they are.
+
+    Usage: {% responsive_image book.cover_image book.image_variants sizes="160px" class="card-img-top" %}
+
+    :param image: ImageFieldFile
+    :param variants: Variants built by build_variants
+    :param sizes: Displayed image width, as in the sizes attribute
+    :param attributes: Additional attributes of the img element
+    :return: HTML of the image
+    """
+    attributes.setdefault('loading', 'lazy')
+    if not variants or variants.get('source') != image.name:
+        return format_html('<img src="{}"{}>', image.url, flatatt(attributes))
+    webp = ''
+    if variants.get('webp'):
+        webp = format_html('<source type="image/webp" srcset="{}" sizes="{}">',
+                           get_srcset(image.storage, variants['webp']), sizes)
+    jpeg = variants['jpeg']
+    return format_html('<picture>{}<img src="{}" srcset="{}" sizes="{}"{}></picture>',
+                       webp, image.storage.url(jpeg[len(jpeg) // 2][1]), get_srcset(image.storage, jpeg), sizes,
+                       flatatt(attributes))
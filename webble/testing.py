@@ -0,0 +1,119 @@
+import json
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from pathlib import Path
+from urllib.parse import parse_qs, quote, unquote, urlsplit
+
+from django.test import override_settings
+from PIL import Image
+
+
+class QueryPlanMixin:
+    """
+    TestCase mixin checking with EXPLAIN QUERY PLAN that a lookup seeks an index
+    and reads the rows in the requested order instead of scanning or sorting them.
+    """
+
+    def assertUsesIndex(self, queryset, index=None):
+        plan = queryset.explain()
+        self.assertIn('SEARCH', plan)
+        self.assertNotIn('SCAN', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+        if index:
+            self.assertIn(f'USING INDEX {index}', plan)
+
+
+class WikiStubHandler(BaseHTTPRequestHandler):
+    """
+    Answers Wiki API queries with the extracts and images of the pages known to the server.
+    Titles are normalized by capitalizing their first letter, unknown titles are reported missing.
+    """
+
+    def do_GET(self):
+        self.server.requests.append(self.path)
+        if self.server.failures:
+            self.server.failures -= 1
+            self.send_error(503)
+            return
+        url = urlsplit(self.path)
+        if url.path.startswith('/images/'):
+            body, content_type = self.server.image, 'image/jpeg'
+        else:
+            body, content_type = json.dumps(self.answer(parse_qs(url.query)['titles'][0].split('|'))).encode(), \
+                'application/json'
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def answer(self, titles):
+        normalized, pages = [], {}
+        for number, title in enumerate(titles, start=1):
+            if title[:1].islower():
+                normalized.append({'from': title, 'to': title[0].upper() + title[1:]})
+                title = title[0].upper() + title[1:]
+            if title not in self.server.pages:
+                pages[str(-number)] = {'title': title, 'missing': ''}
+                continue
+            summary, has_image = self.server.pages[title]
+            pages[str(number)] = {'title': title, 'extract': summary}
+            if has_image:
+                pages[str(number)]['original'] = {'source': f'{self.server.url}/images/{quote(title)}.jpg'}
+        return {'query': {'normalized': normalized, 'pages': pages}}
+
+    def log_message(self, *args):
+        pass
+
+
+class WikiStubServer(ThreadingHTTPServer):
+    """
+    Local stand-in for the Wiki API, recording the paths of the requests it answered.
+    The next failures requests are answered with 503.
+
+    :param pages: Dictionary mapping page titles to tuples of their summary and whether they have an image
+    """
+
+    def __init__(self, pages):
+        super().__init__(('127.0.0.1', 0), WikiStubHandler)
+        self.url = f'http://127.0.0.1:{self.server_address[1]}'
+        self.pages = pages
+        self.requests = []
+        self.failures = 0
+        image = BytesIO()
+        Image.new('RGB', (40, 60), 'white').save(image, 'JPEG')
+        self.image = image.getvalue()
+
+    def image_requests(self):
+        return [unquote(path) for path in self.requests if path.startswith('/images/')]
+
+
+class WikiStubMixin:
+    """
+    TestCase mixin pointing the Wiki client to a local stub server knowing the pages listed in wiki_pages.
+    Every test gets an empty response cache and retries without backoff.
+    """
+    wiki_pages = {}
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.wiki_server = WikiStubServer(cls.wiki_pages)
+        threading.Thread(target=cls.wiki_server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.wiki_server.shutdown()
+        cls.wiki_server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        super().setUp()
+        directory = self.enterContext(tempfile.TemporaryDirectory())
+        self.enterContext(override_settings(WIKI_API_URL=f'{self.wiki_server.url}/w/api.php',
+                                            WIKI_CACHE_PATH=Path(directory) / 'wiki_cache.sqlite3',
+                                            WIKI_RETRY_BACKOFF=0))
+        self.wiki_server.requests.clear()
+        self.wiki_server.failures = 0
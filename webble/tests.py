@@ -1,3 +1,718 @@
-from django.test import TestCase
+import asyncio
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from io import BytesIO, StringIO
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+import fitz
+import requests
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import AsyncRequestFactory, SimpleTestCase, TestCase, RequestFactory, override_settings
+from django.utils import timezone
+from PIL import Image
+
+from user.methods.progress import progress_tracker
+from user.models import ReadingProgress, Review
+from .context_processors import get_genres
+from .methods.catalogue import get_cache_versions
+from .methods.contants import WIKI_BATCH_SIZE
+from .methods.document_pool import DocumentBusy, DocumentPool, document_pool
+from .methods.helper import get_page_cache_key, get_page_image, get_render_key, get_summary, get_wiki_data, sample
+from .methods.page_cache import page_cache
+from .methods.pagination import encode_cursor, keyset_filter
+from .methods.prefetch import PagePrefetcher
+from .methods.search import fts_available, index_book_pages, index_pages, search, BOOK, PAGE, SEARCH_TABLE
+from .methods.render_executor import RenderExecutor, RenderQueueFull
+from .methods.wiki import WikiClient
+from .models import Author, Book, Genre, IngestJob, PageText, RecommendationJob, SimilarBook, FAILED, READY
+from .testing import QueryPlanMixin, WikiStubMixin
+from .views import AsyncReadBookView, get_reader_options
+
+
+class GenreCatalogueTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        Genre.objects.create(genre='Drama')
+        self.request = RequestFactory().get('/')
+
+    def test_navbar_genres_cost_no_queries_once_cached(self):
+        get_genres(self.request)
+        with self.assertNumQueries(0):
+            genres = get_genres(self.request)['genres']
+        self.assertEqual([genre.genre for genre in genres], ['Drama'])
+
+    def test_saving_genre_invalidates_catalogue(self):
+        get_genres(self.request)
+        Genre.objects.create(genre='Poetry')
+        with self.assertNumQueries(1):
+            genres = get_genres(self.request)['genres']
+        self.assertEqual([genre.genre for genre in genres], ['Drama', 'Poetry'])
+
+    def test_deleting_genre_invalidates_catalogue(self):
+        get_genres(self.request)
+        Genre.objects.get(genre='Drama').delete()
+        self.assertEqual(get_genres(self.request)['genres'], [])
+
+    def test_page_query_count(self):
+        # Another query string misses the whole-page cache, so the page is rendered again
+        self.client.get('/authors/?visit=1')
+        with self.assertNumQueries(1):
+            response = self.client.get('/authors/?visit=2')
+        self.assertContains(response, 'Drama')
+
+    def test_cached_page_costs_no_queries(self):
+        self.client.get('/authors/')
+        with self.assertNumQueries(0):
+            response = self.client.get('/authors/')
+        self.assertContains(response, 'Drama')
+
+
+class PageCacheKeyTests(SimpleTestCase):
+    def test_replaced_pdf_changes_cache_key(self):
+        book = Book(pk=1, title='Dune', pdf='books/dune.pdf')
+        key = get_page_cache_key(book, 'standard')
+        book.pdf.name = 'books/dune_v2.pdf'
+        self.assertNotEqual(get_page_cache_key(book, 'standard'), key)
+        self.assertNotEqual(get_page_cache_key(book, 'hidpi'), get_page_cache_key(book, 'standard'))
+
+
+class BookFileMixin:
+    """
+    Gives every test a book with a five page PDF in a temporary MEDIA_ROOT and an empty page cache.
+    """
+
+    def setUp(self):
+        super().setUp()
+        media = Path(self.enterContext(tempfile.TemporaryDirectory()))
+        self.enterContext(override_settings(MEDIA_ROOT=media, PAGE_CACHE_DIR=media / 'page_cache',
+                                            PAGE_PREFETCH_DEPTH=2))
+        document = fitz.open()
+        for _ in range(5):
+            document.new_page()
+        (media / 'books').mkdir()
+        document.save(media / 'books' / 'book.pdf')
+        self.book = Book(pk=1, title='Book', pdf='books/book.pdf', page_count=5)
+        page_cache.invalidate(self.book.pk)
+        self.addCleanup(page_cache.invalidate, self.book.pk)
+        self.addCleanup(document_pool.discard, self.book.pk)
+
+    def cached_pages(self):
+        key = get_page_cache_key(self.book, settings.PAGE_DEFAULT_PROFILE)
+        return [page for page in range(5) if page_cache.get(self.book.pk, page, key) is not None]
+
+
+class DocumentPoolTests(BookFileMixin, SimpleTestCase):
+    def test_open_document_is_reused_until_pdf_changes(self):
+        pool = DocumentPool()
+        with pool.document(self.book) as first:
+            pass
+        with pool.document(self.book) as second:
+            pass
+        self.assertIs(first, second)
+        self.book.pdf.name = 'books/other.pdf'
+        (Path(settings.MEDIA_ROOT) / 'books' / 'book.pdf').rename(Path(settings.MEDIA_ROOT) / self.book.pdf.name)
+        with pool.document(self.book) as replaced:
+            self.assertIsNot(replaced, first)
+        self.assertTrue(first.is_closed)
+
+    @override_settings(DOCUMENT_POOL_SIZE=1)
+    def test_least_recently_used_document_is_closed(self):
+        pool = DocumentPool()
+        with pool.document(self.book) as first:
+            pass
+        with pool.document(Book(pk=2, pdf=self.book.pdf.name)):
+            pass
+        self.assertTrue(first.is_closed)
+
+    def test_busy_or_awaited_document_is_not_lent_without_blocking(self):
+        pool = DocumentPool()
+        with pool.document(self.book):
+            with self.assertRaises(DocumentBusy):
+                with pool.document(self.book, blocking=False):
+                    pass
+        pool._acquire(self.book).waiting = 1
+        with self.assertRaises(DocumentBusy):
+            with pool.document(self.book, blocking=False):
+                pass
+
+    def test_page_rendered_while_waiting_is_not_rendered_again(self):
+        key = get_page_cache_key(self.book, settings.PAGE_DEFAULT_PROFILE)
+        images = []
+        with document_pool.document(self.book):
+            reader = threading.Thread(target=lambda: images.append(get_page_image(self.book, 0)))
+            reader.start()
+            while not document_pool._acquire(self.book).waiting:
+                time.sleep(0.01)
+            page_cache.set(self.book.pk, 0, key, b'rendered meanwhile')
+        reader.join()
+        self.assertEqual(images, [b'rendered meanwhile'])
+
+
+class PageImageTests(BookFileMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        # Served pages schedule prefetching, which would outlive the temporary MEDIA_ROOT
+        self.enterContext(override_settings(PAGE_PREFETCH_DEPTH=0))
+        self.client.force_login(User.objects.create_user('reader'))
+        self.book.save()
+        self.url = f'/book/{self.book.pk}/page/1.jpg'
+
+    def test_unchanged_page_answers_not_modified(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(f'max-age={settings.PAGE_IMAGE_MAX_AGE}', response['Cache-Control'])
+        self.assertIn('public', response['Cache-Control'])
+        cached = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(cached.status_code, 304)
+        self.assertEqual(cached['ETag'], response['ETag'])
+
+    def test_missing_pdf_is_not_found(self):
+        (Path(settings.MEDIA_ROOT) / self.book.pdf.name).unlink()
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+
+class RenderProfileTests(BookFileMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.enterContext(override_settings(PAGE_PREFETCH_DEPTH=0))
+        self.client.force_login(User.objects.create_user('reader'))
+        self.book.save()
+        self.url = f'/book/{self.book.pk}/page/1.jpg'
+
+    def test_unknown_profiles_fall_back_to_the_default(self):
+        self.assertEqual(get_reader_options({'profile': 'huge', 'mode': 'audio'}),
+                         (settings.PAGE_DEFAULT_PROFILE, 'image'))
+        self.assertEqual(get_reader_options({'profile': 'phone', 'mode': 'text'}), ('phone', 'text'))
+
+    def test_only_whitelisted_profiles_are_rendered(self):
+        self.assertEqual(self.client.get(self.url, {'profile': 'huge'}).status_code, 404)
+        response = self.client.get(self.url, {'profile': 'hidpi'})
+        self.assertEqual(response['Content-Type'], 'image/webp')
+        self.assertNotEqual(response['ETag'], self.client.get(self.url)['ETag'])
+
+    def test_changed_profile_settings_change_the_render_key(self):
+        key = get_render_key('standard')
+        profiles = {**settings.PAGE_RENDER_PROFILES, 'standard': {'dpi': 96, 'format': 'jpeg', 'quality': 90}}
+        with override_settings(PAGE_RENDER_PROFILES=profiles):
+            self.assertNotEqual(get_render_key('standard'), key)
+
+
+class PagePrefetcherTests(BookFileMixin, SimpleTestCase):
+    def prefetch(self, page):
+        prefetcher = PagePrefetcher()
+        prefetcher.schedule(self.book, page)
+        if prefetcher._executor is not None:
+            prefetcher._executor.shutdown(wait=True)
+
+    def test_following_pages_are_rendered(self):
+        self.prefetch(1)
+        self.assertEqual(self.cached_pages(), [2, 3])
+
+    def test_prefetch_stops_at_the_last_page(self):
+        self.prefetch(3)
+        self.assertEqual(self.cached_pages(), [4])
+
+    def test_pages_are_skipped_while_a_reader_uses_the_document(self):
+        with document_pool.document(self.book):
+            self.prefetch(1)
+        self.assertEqual(self.cached_pages(), [])
+
+
+class WikiClientTests(WikiStubMixin, SimpleTestCase):
+    wiki_pages = {'Frank Herbert': ('American science fiction author', True)}
+
+    def test_summary_of_known_and_missing_pages(self):
+        self.assertEqual(get_summary('Frank Herbert'), 'American science fiction author')
+        self.assertEqual(get_summary('Nobody'), 'Page not found')
+
+    def test_responses_are_cached(self):
+        client = WikiClient()
+        params = {'action': 'query', 'titles': 'Frank Herbert'}
+        self.assertEqual(client.query(params), client.query(params))
+        self.assertEqual(len(self.wiki_server.requests), 1)
+
+    def test_transient_failures_are_retried(self):
+        self.wiki_server.failures = 2
+        image = WikiClient().download(f'{self.wiki_server.url}/images/Frank%20Herbert.jpg')
+        self.assertEqual(image, self.wiki_server.image)
+        self.assertEqual(len(self.wiki_server.requests), 3)
+
+    @override_settings(WIKI_MAX_RETRIES=1)
+    def test_persistent_failures_raise(self):
+        self.wiki_server.failures = 5
+        with self.assertRaises(requests.RequestException):
+            WikiClient().query({'action': 'query', 'titles': 'Frank Herbert'})
+        self.assertEqual(len(self.wiki_server.requests), 2)
+
+
+class WikiBatchTests(WikiStubMixin, SimpleTestCase):
+    wiki_pages = {'Frank Herbert': ('American science fiction author', True), 'Dune': ('Novel', False)}
+
+    def test_summaries_and_images_of_several_pages(self):
+        data = get_wiki_data(['frank Herbert', 'Dune', 'Nobody', 'Dune'])
+        self.assertEqual(data, {'frank Herbert': ('American science fiction author', self.wiki_server.image),
+                                'Dune': ('Novel', None), 'Nobody': ('Page not found', None)})
+        self.assertEqual(len(self.wiki_server.requests), 2)
+        self.assertEqual(self.wiki_server.image_requests(), ['/images/Frank Herbert.jpg'])
+
+    def test_titles_are_batched(self):
+        names = [f'Author {number}' for number in range(WIKI_BATCH_SIZE + 1)]
+        self.assertEqual(len(get_wiki_data(names)), len(names))
+        self.assertEqual(len(self.wiki_server.requests), 2)
+
+    def test_images_are_not_downloaded_unless_requested(self):
+        self.assertEqual(get_wiki_data(['Frank Herbert'], images=False),
+                         {'Frank Herbert': ('American science fiction author', None)})
+        self.assertEqual(self.wiki_server.image_requests(), [])
+
+
+class ImportBooksTests(TestCase):
+    def setUp(self):
+        self.source = Path(self.enterContext(tempfile.TemporaryDirectory()))
+        self.enterContext(override_settings(MEDIA_ROOT=self.enterContext(tempfile.TemporaryDirectory())))
+        document = fitz.open()
+        document.new_page()
+        document.save(self.source / 'dune.pdf')
+
+    def import_books(self, manifest):
+        (self.source / 'books.csv').write_text(manifest)
+        errors = StringIO()
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('import_books', str(self.source / 'books.csv'), '--workers', '1',
+                         stdout=StringIO(), stderr=errors)
+        return errors.getvalue()
+
+    def test_unreadable_entries_are_skipped(self):
+        (self.source / 'broken.pdf').write_bytes(b'not a pdf')
+        errors = self.import_books('file,title,authors,genres\ndune.pdf,Dune,Frank Herbert,\n'
+                                   'broken.pdf,Broken,,\nmissing.pdf,Missing,,\n')
+        self.assertEqual(list(Book.objects.values_list('title', 'page_count')), [('Dune', 1)])
+        self.assertIn('broken.pdf', errors)
+        self.assertIn('missing.pdf', errors)
+
+    def test_imported_genres_reach_the_navbar(self):
+        cache.clear()
+        get_genres(RequestFactory().get('/'))
+        self.import_books('file,title,authors,genres\ndune.pdf,Dune,Frank Herbert,Science fiction\n')
+        genres = get_genres(RequestFactory().get('/'))['genres']
+        self.assertEqual([genre.genre for genre in genres], ['Science fiction'])
+
+    def test_imported_books_are_queued_for_recommendations(self):
+        self.import_books('file,title,authors,genres\ndune.pdf,Dune,Frank Herbert,Science fiction\n')
+        job = RecommendationJob.objects.get()
+        self.assertEqual((job.book.title, job.refresh_similar), ('Dune', True))
+
+    def test_import_invalidates_catalogue_pages(self):
+        cache.clear()
+        self.client.get('/books/')
+        self.import_books('file,title,authors,genres\ndune.pdf,Dune,Frank Herbert,Science fiction\n')
+        self.assertContains(self.client.get('/books/'), 'Dune')
+
+
+class SearchTests(TestCase):
+    def setUp(self):
+        self.book = Book.objects.create(title='Dune', pdf='books/dune.pdf', description='Desert planet')
+        self.author = Author.objects.create(name='Frank Herbert', bio='American science fiction author')
+
+    def search(self, phrase):
+        return search(phrase, Book, Author, PageText)
+
+    def indexed_kinds(self, book):
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT kind FROM {SEARCH_TABLE} WHERE kind IN (%s, %s) AND object_id = %s',
+                           [BOOK, PAGE, book.pk])
+            return sorted(row[0] for row in cursor.fetchall())
+
+    def test_table_lookup_is_remembered(self):
+        self.assertTrue(fts_available())
+        with self.assertNumQueries(0):
+            self.assertTrue(fts_available())
+
+    def test_titles_descriptions_and_bios_are_found(self):
+        self.assertEqual(self.search('dune')[0], [self.book])
+        self.assertEqual(self.search('deser')[0], [self.book])
+        self.assertEqual(self.search('american')[1], [self.author])
+
+    def test_page_text_is_found(self):
+        index_pages(self.book, [(1, 'The spice must flow'), (2, 'Sandworms of Arrakis')])
+        books, authors, pages = self.search('spice')
+        self.assertEqual((books, authors), ([], []))
+        self.assertEqual([(book, page) for book, page, _ in pages], [(self.book, 1)])
+        self.assertIn('spice', pages[0][2])
+
+    def test_deleted_book_is_removed_from_index(self):
+        index_pages(self.book, [(1, 'The spice must flow')])
+        self.assertEqual(self.indexed_kinds(self.book), [BOOK, PAGE])
+        self.book.delete()
+        self.assertEqual(self.indexed_kinds(self.book), [])
+
+    def test_query_syntax_is_not_interpreted(self):
+        for phrase in ('"dune" OR *', 'NEAR(dune', 'title:dune', '-dune', 'dune"', 'AND'):
+            self.search(phrase)
+        self.assertEqual(self.search('*'), ([], [], []))
+        self.assertEqual(self.search('dune"')[0], [self.book])
+
+
+@override_settings(INGEST_ASYNC=False)
+class ReplacedPdfTests(WikiStubMixin, TestCase):
+    wiki_pages = {'Dune': ('Novel', False)}
+
+    @staticmethod
+    def make_pdf(*texts):
+        document = fitz.open()
+        for text in texts:
+            document.new_page().insert_text((72, 72), text)
+        return ContentFile(document.tobytes())
+
+    def search_pages(self, phrase):
+        return [(book, page) for book, page, _ in search(phrase, Book, Author, PageText)[2]]
+
+    def test_replaced_pdf_is_indexed_again(self):
+        with tempfile.TemporaryDirectory() as media, \
+                override_settings(MEDIA_ROOT=media, PAGE_CACHE_DIR=Path(media) / 'page_cache'):
+            book = Book(title='Dune')
+            with self.captureOnCommitCallbacks(execute=True):
+                book.pdf.save('dune.pdf', self.make_pdf('The spice must flow'))
+            self.assertEqual(self.search_pages('spice'), [(book, 1)])
+            with self.captureOnCommitCallbacks(execute=True):
+                book.pdf.save('dune_v2.pdf', self.make_pdf('Sandworms', 'Arrakis'))
+            book.refresh_from_db()
+            self.assertEqual((book.page_count, book.status), (2, READY))
+            self.assertEqual(self.search_pages('spice'), [])
+            self.assertEqual(self.search_pages('arrakis'), [(book, 2)])
+            self.assertEqual(list(book.pagetext_set.values_list('page', flat=True)), [1, 2])
+
+
+class IngestJobTests(TestCase):
+    def setUp(self):
+        self.book = Book.objects.create(title='Dune', pdf='books/dune.pdf')
+        self.job = IngestJob.objects.get(book=self.book)
+
+    def expire_lease(self, **changes):
+        expired = timezone.now() - timedelta(seconds=settings.INGEST_LEASE + 1)
+        IngestJob.objects.filter(pk=self.job.pk).update(claimed_at=expired, **changes)
+
+    def test_job_with_expired_lease_is_claimed_again(self):
+        self.assertEqual(IngestJob.claim_next().pk, self.job.pk)
+        self.assertIsNone(IngestJob.claim_next())
+        self.expire_lease()
+        reclaimed = IngestJob.claim_next()
+        self.assertEqual((reclaimed.pk, reclaimed.attempts), (self.job.pk, 1))
+        self.assertIsNone(IngestJob.claim_next())
+
+    def test_job_out_of_attempts_fails_when_lease_expires(self):
+        self.expire_lease(status=IngestJob.RUNNING, attempts=settings.INGEST_MAX_ATTEMPTS - 1)
+        self.assertIsNone(IngestJob.claim_next())
+        self.job.refresh_from_db()
+        self.book.refresh_from_db()
+        self.assertEqual((self.job.status, self.book.status), (FAILED, FAILED))
+
+
+class TextLayerTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        media = Path(self.enterContext(tempfile.TemporaryDirectory()))
+        self.enterContext(override_settings(MEDIA_ROOT=media, PAGE_PREFETCH_DEPTH=0))
+        document = fitz.open()
+        page = document.new_page()
+        page.insert_text((72, 72), 'Chapter One', fontsize=24)
+        page.insert_text((72, 160), 'Plain <text>', fontsize=11)
+        page.insert_text((72, 240), 'Bold words', fontname='hebo', fontsize=11)
+        image = BytesIO()
+        Image.new('RGB', (60, 80), 'gray').save(image, 'PNG')
+        page = document.new_page()
+        page.insert_image(page.rect, stream=image.getvalue())
+        page.insert_text((72, 72), 'Caption', fontsize=11)
+        document.new_page()
+        (media / 'books').mkdir()
+        document.save(media / 'books' / 'book.pdf')
+        self.book = Book.objects.create(title='Book', pdf='books/book.pdf', page_count=3)
+        self.addCleanup(document_pool.discard, self.book.pk)
+        index_book_pages(self.book)
+
+    def test_text_blocks_become_escaped_html(self):
+        page_text = PageText.objects.get(book=self.book, page=1)
+        self.assertFalse(page_text.image_heavy)
+        self.assertIn('<h4>Chapter One</h4>', page_text.html)
+        self.assertIn('<p>Plain &lt;text&gt;</p>', page_text.html)
+        self.assertIn('<p><b>Bold words</b></p>', page_text.html)
+
+    def test_pages_of_images_or_without_text_are_flagged(self):
+        flags = dict(PageText.objects.filter(book=self.book).values_list('page', 'image_heavy'))
+        self.assertEqual(flags, {1: False, 2: True, 3: True})
+
+    def test_text_mode_falls_back_to_the_image_of_flagged_pages(self):
+        self.client.force_login(User.objects.create_user('reader'))
+        # Write the buffered progress before the test database is rolled back
+        self.addCleanup(progress_tracker.flush)
+        self.assertContains(self.client.get(f'/book/{self.book.pk}/page/1/', {'mode': 'text'}), 'Chapter One')
+        response = self.client.get(f'/book/{self.book.pk}/page/2/', {'mode': 'text'})
+        self.assertIsNone(response.context['page_html'])
+        self.assertContains(response, f'/book/{self.book.pk}/page/2.jpg')
+
+
+class RandomSampleTests(TestCase):
+    def setUp(self):
+        Genre.objects.bulk_create([Genre(genre=f'Genre {number}', random_key=number / 10 + 0.05)
+                                   for number in range(10)])
+
+    def sample(self, start, k):
+        with mock.patch('webble.methods.helper.random.random', return_value=start):
+            return [genre.genre for genre in sample(Genre.objects.all(), k)]
+
+    def test_rows_are_read_from_the_random_start(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(self.sample(0.1, 3), ['Genre 1', 'Genre 2', 'Genre 3'])
+
+    def test_sample_wraps_around_to_the_first_rows(self):
+        with self.assertNumQueries(2):
+            self.assertEqual(self.sample(0.9, 3), ['Genre 9', 'Genre 0', 'Genre 1'])
+
+    def test_small_tables_are_returned_whole(self):
+        self.assertEqual(sorted(self.sample(0.5, 20)), [f'Genre {number}' for number in range(10)])
+
+    def test_shuffle_assigns_new_keys(self):
+        keys = list(Genre.objects.order_by('pk').values_list('random_key', flat=True))
+        call_command('shuffle', stdout=StringIO())
+        self.assertNotEqual(list(Genre.objects.order_by('pk').values_list('random_key', flat=True)), keys)
+
+
+class RecommendationJobTests(TestCase):
+    def setUp(self):
+        self.genre = Genre.objects.create(genre='Drama')
+        self.books = [Book.objects.create(title=f'Book {number}', pdf='books/book.pdf') for number in range(2)]
+
+    def queued_books(self):
+        return set(RecommendationJob.objects.values_list('book', flat=True))
+
+    def test_new_reader_only_queues_the_book(self):
+        ReadingProgress.objects.create(user=User.objects.create_user('reader'), book=self.books[0], last_page_read=1)
+        self.assertEqual(self.queued_books(), {self.books[0].pk})
+        self.assertFalse(SimilarBook.objects.exists())
+
+    def test_changes_from_the_genre_side_refresh_recommendations(self):
+        self.genre.book_set.add(*self.books)
+        self.assertEqual(self.queued_books(), {book.pk for book in self.books})
+        self.assertEqual(RecommendationJob.run_pending(), 2)
+        self.assertEqual(SimilarBook.objects.get(book=self.books[0]).similar, self.books[1])
+        self.genre.book_set.clear()
+        self.assertEqual(self.queued_books(), {book.pk for book in self.books})
+        RecommendationJob.run_pending()
+        self.assertFalse(SimilarBook.objects.exists())
+
+
+class ResponseCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.book = Book.objects.create(title='Dune', pdf='books/dune.pdf')
+        self.user = User.objects.create_user('reader', password='password')
+
+    def test_anonymous_pages_are_served_from_cache(self):
+        for url in ('/authors/', '/books/', f'/book/{self.book.pk}/'):
+            self.client.get(url)
+            with self.assertNumQueries(0):
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertIn('Cookie', response['Vary'])
+            self.assertNotContains(response, 'csrfmiddlewaretoken')
+
+    def test_saving_book_invalidates_pages(self):
+        self.client.get('/books/')
+        self.book.title = 'Dune Messiah'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.book.save()
+        self.assertContains(self.client.get('/books/'), 'Dune Messiah')
+
+    def test_review_invalidates_book_page(self):
+        self.client.get(f'/book/{self.book.pk}/')
+        with self.captureOnCommitCallbacks(execute=True):
+            Review.objects.create(book=self.book, user=self.user, rating=5, review='Spice')
+        self.assertContains(self.client.get(f'/book/{self.book.pk}/'), 'Spice')
+
+    def test_versions_change_only_after_commit(self):
+        versions = get_cache_versions(['catalogue', 'ratings', f'book:{self.book.pk}'])
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.book.title = 'Dune Messiah'
+            self.book.save()
+            Review.objects.create(book=self.book, user=self.user, rating=5, review='Spice')
+        self.assertEqual(get_cache_versions(['catalogue', 'ratings', f'book:{self.book.pk}']), versions)
+        for callback in callbacks:
+            callback()
+        changed = get_cache_versions(['catalogue', 'ratings', f'book:{self.book.pk}'])
+        self.assertTrue(all(changed[name] != versions[name] for name in versions))
+
+    def test_logged_in_pages_are_not_served_from_cache(self):
+        self.client.get(f'/book/{self.book.pk}/')
+        self.client.force_login(self.user)
+        response = self.client.get(f'/book/{self.book.pk}/')
+        self.assertContains(response, 'Leave a Review')
+        self.assertIn('Cookie', response['Vary'])
+
+
+class AdminRefreshTests(WikiStubMixin, TestCase):
+    wiki_pages = {'Frank Herbert': ('Author of Dune', True), 'Dune': ('Novel about spice', False)}
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.enterContext(override_settings(MEDIA_ROOT=self.enterContext(tempfile.TemporaryDirectory())))
+        self.book = Book.objects.create(title='Dune', pdf='books/dune.pdf', description='Old description')
+        self.author = Author.objects.create(name='Frank Herbert', bio='Old bio')
+        self.client.force_login(User.objects.create_superuser('admin'))
+
+    def refresh(self, entry):
+        versions = get_cache_versions(['catalogue'])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/admin/webble/{entry._meta.model_name}/',
+                             {'action': 'refresh_from_wiki', '_selected_action': [entry.pk]})
+        self.assertNotEqual(get_cache_versions(['catalogue']), versions)
+        entry.refresh_from_db()
+
+    def test_refreshed_description_is_indexed(self):
+        self.refresh(self.book)
+        self.assertEqual(self.book.description, 'Novel about spice')
+        self.assertEqual(search('spice', Book, Author, PageText)[0], [self.book])
+
+    def test_refreshed_bio_and_portrait_variants_are_saved(self):
+        self.refresh(self.author)
+        self.assertEqual(self.author.bio, 'Author of Dune')
+        self.assertTrue(self.author.image_variants)
+        self.assertEqual(search('dune', Book, Author, PageText)[1], [self.author])
+
+
+class CatalogueQueryPlanTests(QueryPlanMixin, TestCase):
+    """
+    Checks that the catalogue lookups seek an index instead of scanning the table.
+    """
+
+    def test_book_title_lookup_uses_index(self):
+        self.assertUsesIndex(Book.objects.filter(title='Dune'), 'webble_book_title_idx')
+
+    def test_author_name_lookup_uses_index(self):
+        self.assertUsesIndex(Author.objects.filter(name='Frank Herbert'), 'webble_author_name_idx')
+
+    def test_keyset_page_uses_index(self):
+        queryset = Book.objects.filter(keyset_filter(['title', 'pk'], ['Dune', 1])).order_by('title', 'pk')[:19]
+        self.assertUsesIndex(queryset, 'webble_book_title_idx')
+
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        Book.objects.bulk_create([Book(title=f'Book {number:02d}', pdf='books/book.pdf',
+                                       cover_image='covers/not_found.jpg') for number in range(40)])
+        self.client.force_login(User.objects.create_user('reader'))
+
+    def get_titles(self, response):
+        return [book.title for book in response.context['books']]
+
+    def test_cursors_walk_pages_forward_and_back(self):
+        first = self.client.get('/books/')
+        self.assertEqual(self.get_titles(first)[0], 'Book 00')
+        self.assertFalse(first.context['page_obj'].has_previous())
+        second = self.client.get(f'/books/?cursor={first.context["page_obj"].next_cursor}')
+        self.assertEqual(self.get_titles(second), [f'Book {number:02d}' for number in range(18, 36)])
+        back = self.client.get(f'/books/?cursor={second.context["page_obj"].previous_cursor}')
+        self.assertEqual(self.get_titles(back), self.get_titles(first))
+        self.assertFalse(back.context['page_obj'].has_previous())
+        self.assertEqual(back.context['estimated_count'], 40)
+
+    def test_invalid_cursor_is_not_found(self):
+        self.assertEqual(self.client.get('/books/?cursor=invalid').status_code, 404)
+
+    def test_cursor_with_wrongly_typed_values_is_not_found(self):
+        for url, values in (('/books/', ['x', 'abc']), ('/books/?sort=rating&', ['abc', 'x', 1]),
+                            ('/authors/', ['x', {'a': 1}]), ('/books/', ['x', None])):
+            separator = '' if url.endswith('&') else '?'
+            response = self.client.get(f'{url}{separator}cursor={encode_cursor("after", values)}')
+            self.assertEqual(response.status_code, 404)
+
+
+class ApiTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.authors = Author.objects.bulk_create([Author(name=f'Author {number}') for number in range(3)])
+        self.books = Book.objects.bulk_create([Book(title=f'Book {number}', pdf='books/book.pdf',
+                                                    cover_image='covers/not_found.jpg') for number in range(5)])
+        for book in self.books:
+            book.authors.set(self.authors)
+
+    def test_selected_fields_of_requested_ids(self):
+        ids = f'{self.books[0].pk},{self.books[2].pk}'
+        response = self.client.get(f'/api/books/?fields=id,title,authors&ids={ids}')
+        self.assertEqual(response.json(), {'results': [
+            {'id': self.books[0].pk, 'title': 'Book 0', 'authors': [author.pk for author in self.authors]},
+            {'id': self.books[2].pk, 'title': 'Book 2', 'authors': [author.pk for author in self.authors]},
+        ], 'next': None})
+
+    def test_related_rows_are_not_queried_per_row(self):
+        with self.assertNumQueries(3):
+            self.client.get('/api/books/')
+
+    def test_cursor_pagination(self):
+        first = self.client.get('/api/books/?fields=id&limit=3').json()
+        second = self.client.get(f'/api/books/?fields=id&limit=3&cursor={first["next"]}').json()
+        self.assertEqual([row['id'] for row in first['results'] + second['results']],
+                         [book.pk for book in self.books])
+        self.assertIsNone(second['next'])
+
+    def test_unchanged_data_answers_not_modified_without_queries(self):
+        etag = self.client.get('/api/authors/')['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/authors/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        with self.captureOnCommitCallbacks(execute=True):
+            Author.objects.create(name='Author 3')
+        self.assertEqual(self.client.get('/api/authors/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_unknown_field_is_rejected(self):
+        self.assertEqual(self.client.get('/api/books/?fields=secret').status_code, 400)
+
+    def test_invalid_cursor_is_rejected(self):
+        for cursor in ('invalid', encode_cursor('after', ['abc']), encode_cursor('after', [{'a': 1}]),
+                       encode_cursor('before', [1])):
+            response = self.client.get(f'/api/books/?cursor={cursor}')
+            self.assertEqual((response.status_code, response.json()), (400, {'error': 'Invalid cursor'}))
+
+
+class AsyncReaderTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('reader')
+        self.book = Book.objects.create(title='Book', pdf='books/book.pdf', cover_image='covers/not_found.jpg',
+                                        page_count=2)
+        PageText.objects.create(book=self.book, page=1, text='Text', html='<p>Text</p>')
+
+    async def read(self, user, page=1):
+        request = AsyncRequestFactory().get(f'/book/{self.book.pk}/page/{page}/', {'mode': 'text'})
+        request.user = user
+        return await AsyncReadBookView.as_view()(request, pk=self.book.pk, page_number=page)
+
+    async def test_page_is_rendered_and_progress_recorded(self):
+        response = await self.read(self.user)
+        self.assertContains(response, '<p>Text</p>')
+        self.assertTrue(await ReadingProgress.objects.filter(user=self.user, book=self.book).aexists())
+
+    async def test_anonymous_reader_is_redirected_to_login(self):
+        response = await self.read(AnonymousUser())
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(response.url.startswith('/login?next='))
+
+    @override_settings(PAGE_RENDER_WORKERS=1, PAGE_RENDER_MAX_PENDING=0)
+    async def test_full_render_executor_refuses_jobs(self):
+        executor, release = RenderExecutor(), threading.Event()
+        running = asyncio.ensure_future(executor.run(release.wait))
+        await asyncio.sleep(0)
+        with self.assertRaises(RenderQueueFull):
+            await executor.run(release.wait)
+        release.set()
+        self.assertTrue(await running)
+        self.assertEqual(await executor.run(sum, [1, 2]), 3)
@@ -1,9 +1,15 @@
+from django.conf import settings
 from django.urls import path
 
-from . import views
+from . import api, views
 
 app_name = 'webble'
 
+if settings.READER_ASYNC:
+    read_book_view, page_image_view = views.AsyncReadBookView, views.AsyncPageImageView
+else:
+    read_book_view, page_image_view = views.ReadBookView, views.PageImageView
+
 urlpatterns = [
     path('', views.HomeView.as_view(), name='home'),
     path('authors/', views.AllAuthorsView.as_view(), name='all_authors'),
@@ -12,5 +18,9 @@ urlpatterns = [
     path('book/<int:pk>/', views.BookDetailView.as_view(), name='book_detail'),
     path('author/<int:pk>/', views.AuthorDetailView.as_view(), name='author_detail'),
     path('search/', views.SearchBookView.as_view(), name='search_book'),
-    path('book/<str:title>/page/<int:page_number>/', views.ReadBookView.as_view(), name='read_book'),
+    path('book/<int:pk>/page/<int:page_number>/', read_book_view.as_view(), name='read_book'),
+    path('book/<int:pk>/page/<int:page_number>.jpg', page_image_view.as_view(), name='page_image'),
+    path('api/books/', api.BookApiView.as_view(), name='api_books'),
+    path('api/authors/', api.AuthorApiView.as_view(), name='api_authors'),
+    path('api/genres/', api.GenreApiView.as_view(), name='api_genres'),
 ]
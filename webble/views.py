@@ -1,14 +1,27 @@
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth.mixins import LoginRequiredMixin
+from django.contrib.auth.views import redirect_to_login
 from django.core.paginator import Paginator
-from django.db.models import Avg
+from django.db.models import FloatField
+from django.db.models.functions import Cast, Coalesce, NullIf
+from django.http import Http404, HttpResponse
 from django.shortcuts import get_object_or_404, redirect, render
-from django.views.generic import ListView, DetailView
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+from django.views.generic import ListView, DetailView, View
 
-from user.models import Bookmark, Review
-from .models import Book, Author, Genre
-from .methods.helper import get_pdf_data, decode_image_data, get_books_by_genre
-from user.methods.helper import get_review, update_reading_progress
+from user.models import Review
+from .models import Book, Author, Genre, PageText
+from .methods.contants import READER_MODES, RENDER_FORMATS
+from .methods.helper import get_page_image, get_page_version, get_books_by_genre, sample
+from .methods.pagination import KeysetPaginationMixin
+from .methods.prefetch import page_prefetcher
+from .methods.render_executor import render_executor, RenderQueueFull
+from .methods.response_cache import CachedPageMixin
+from .methods.search import search
+from user.methods.helper import add_bookmarks, aupdate_reading_progress, get_review, update_reading_progress
 
 
 class HomeView(ListView):
@@ -31,27 +44,51 @@ class HomeView(ListView):
         return context
 
 
-class AllAuthorsView(ListView):
+class AllAuthorsView(CachedPageMixin, KeysetPaginationMixin, ListView):
     """
     This view is responsible for displaying all available authors.
     """
     model = Author
     template_name = 'all_authors.html'
     context_object_name = 'authors'
-    ordering = 'name'
+    keyset_ordering = ('name', 'pk')
+    estimate_count = True
     paginate_by = 18
 
 
-class AllBooksView(ListView):
+class AllBooksView(CachedPageMixin, KeysetPaginationMixin, ListView):
     """
     This view is responsible for displaying all available books.
+    Books are sorted by title, or by average rating with ?sort=rating.
     """
+    cache_scopes = ('catalogue', 'ratings')
     model = Book
     template_name = 'all_books.html'
     context_object_name = 'books'
-    ordering = 'title'
+    estimate_count = True
     paginate_by = 18
 
+    def get_queryset(self):
+        """
+        Sorting by rating uses the rating aggregates stored on the books, no reviews are grouped.
+        Books without reviews get an average of -1, so they are listed last and the average is never NULL.
+        """
+        queryset = super().get_queryset()
+        if self.request.GET.get('sort') == 'rating':
+            average = Cast('rating_sum', FloatField()) / NullIf('rating_count', 0)
+            queryset = queryset.annotate(average=Coalesce(average, -1.0))
+        return queryset
+
+    def get_keyset_ordering(self):
+        if self.request.GET.get('sort') == 'rating':
+            return '-average', 'title', 'pk'
+        return 'title', 'pk'
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['sort'] = self.request.GET.get('sort', '')
+        return context
+
 
 class GenreListView(ListView):
     """
@@ -63,7 +100,8 @@ class GenreListView(ListView):
     def get_context_data(self, **kwargs):
         """
         Builds additional context needed.
-        Context['genre_books'] provides a list of book objects that can be displayed.
+        Context['genre_books'] provides a list of book objects that can be displayed, in random key order,
+        so the order is random but stays the same between pages.
         Context['genre'] is the selected genre.
 
         :param kwargs: retrieves context built by ListView.
@@ -71,16 +109,17 @@ class GenreListView(ListView):
         """
         context = super().get_context_data(**kwargs)
         genre = get_object_or_404(Genre, pk=self.kwargs['pk'])
-        books = Paginator(Book.objects.filter(genres=genre).order_by('?'), 18)
+        books = Paginator(Book.objects.filter(genres=genre).order_by('random_key', 'pk'), 18)
         context['genre_books'] = books.get_page(self.request.GET.get('page'))
         context['genre'] = genre
         return context
 
 
-class BookDetailView(DetailView):
+class BookDetailView(CachedPageMixin, DetailView):
     """
     This view is responsible for displaying information about a specified book.
     """
+    cache_scopes = ('catalogue', 'book:{pk}')
     model = Book
     template_name = 'book_detail.html'
     context_object_name = 'book'
@@ -88,24 +127,28 @@ class BookDetailView(DetailView):
     def get_context_data(self, **kwargs):
         """
         Builds context needed to obtain needed information to display.
-        Context[similar_books] provides random books that are similar to the book accessed.
+        Context[similar_books] provides the precomputed recommendations for the book accessed,
+        or random books sharing a genre while none are computed yet.
         Context[reviews] provides all the reviews associated with the book.
-        Context[rating] provides the average of all ratings for the associated book.
+        Context[rating] provides the average of all ratings for the associated book, kept on the book itself.
 
         :param kwargs: retrieves context built by DetailView.
         :return: Context dictionary
         """
         context = super().get_context_data(**kwargs)
-        similar_books = Book.objects.filter(genres__in=self.object.genres.all()).exclude(pk=self.object.pk)
-        context['similar_books'] = similar_books.order_by('?')[:5]
-        context['reviews'] = Review.objects.filter(book__pk=self.object.pk)
-        context['rating'] = context['reviews'].aggregate(Avg('rating'))['rating__avg']
+        recommendations = self.object.recommendations.select_related('similar')[:5]
+        context['similar_books'] = [recommendation.similar for recommendation in recommendations]
+        if not context['similar_books']:
+            similar_books = Book.objects.filter(genres__in=self.object.genres.all()).exclude(pk=self.object.pk)
+            context['similar_books'] = sample(similar_books.distinct(), 5)
+        context['reviews'] = Review.objects.filter(book__pk=self.object.pk).with_related()
+        context['rating'] = self.object.rating
         if self.request.user.is_authenticated:
             context['user_review'] = get_review(self.request.user, self.object.pk) or None
         return context
 
 
-class AuthorDetailView(DetailView):
+class AuthorDetailView(CachedPageMixin, DetailView):
     """
     This view is responsible for displaying information about a specified author.
     """
@@ -116,14 +159,14 @@ class AuthorDetailView(DetailView):
     def get_context_data(self, **kwargs):
         """
         Handles building additional context with needed information.
-        Obtain books written by the author object by filtering.
+        Obtain books written by the author object by filtering, in random key order.
 
         :param kwargs: retrieves base context built by DetailView.
         :return: Context dictionary.
         """
         context = super().get_context_data(**kwargs)
         written_books = Book.objects.filter(authors=self.object)
-        paginator = Paginator(written_books.order_by('?'), 6)
+        paginator = Paginator(written_books.order_by('random_key', 'pk'), 6)
         context['written'] = paginator.get_page(self.request.GET.get('page'))
         return context
 
@@ -131,20 +174,85 @@ class AuthorDetailView(DetailView):
 class SearchBookView(ListView):
     """
     This view is responsible for displaying the result of the searched phrase.
+    The navbar form searches with GET, so the pages carrying it hold no CSRF token and can be cached.
     """
     template_name = 'search_book.html'
 
+    @staticmethod
+    def get(request):
+        """
+        Handles the GET request for searching books, authors and book pages based on a given phrase.
+
+        :param request: The incoming request object.
+        :return: A rendered response with the search results.
+        """
+        return SearchBookView.render_results(request, request.GET.get('name'))
+
     @staticmethod
     def post(request):
         """
-        Handles the POST request for searching books and authors based on a given phrase.
+        Handles the POST request for searching books, authors and book pages based on a given phrase.
 
         :param request: The incoming request object.
         :return: A rendered response with the search results.
         """
-        searched = Book.objects.filter(title__icontains=request.POST.get('name'))
-        searched_authors = Author.objects.filter(name__icontains=request.POST.get('name'))
-        return render(request, 'search_book.html', {'searched_books': searched, 'searched_authors': searched_authors})
+        return SearchBookView.render_results(request, request.POST.get('name'))
+
+    @staticmethod
+    def render_results(request, phrase):
+        searched, searched_authors, page_hits = search(phrase, Book, Author, PageText)
+        return render(request, 'search_book.html', {'searched_books': searched, 'searched_authors': searched_authors,
+                                                    'page_hits': page_hits})
+
+
+def get_reader_options(params):
+    """
+    Reads the render profile and the reading mode of the reader from the query parameters.
+    Unknown profiles and modes fall back to the default ones.
+
+    :param params: Query parameters of the request
+    :return: Tuple of the profile name and the mode
+    """
+    profile = params.get('profile')
+    if profile not in settings.PAGE_RENDER_PROFILES:
+        profile = settings.PAGE_DEFAULT_PROFILE
+    mode = params.get('mode')
+    return profile, mode if mode in READER_MODES else READER_MODES[0]
+
+
+def get_reader_context(book, page_number, profile, mode):
+    """
+    Builds the context of the reader shared by the sync and async ReadBook views.
+
+    :return: Context dictionary
+    """
+    return {'book': book, 'object': book, 'page_number': page_number,
+            'next': page_number+1, 'previous': page_number-1,
+            'profile': profile, 'profiles': list(settings.PAGE_RENDER_PROFILES), 'mode': mode, 'modes': READER_MODES}
+
+
+def bookmark_pages(request, book, page_number):
+    """
+    Bookmarks the current page, or every page listed in the 'pages' field.
+
+    :param request: The incoming request object.
+    :param book: Book object
+    :param page_number: The page number of the book.
+    :return: A redirect response back to the page, keeping the render profile.
+    """
+    if 'bookmark' in request.POST:
+        try:
+            pages = {int(page) for page in request.POST.getlist('pages')} or {page_number}
+        except ValueError:
+            pages = set()
+        pages = [page for page in pages if 0 < page <= (book.page_count or 0)]
+        if not pages:
+            messages.error(request, 'Invalid page')
+        elif add_bookmarks(request.user, book, pages):
+            messages.success(request, 'Bookmark submission successful')
+        else:
+            messages.warning(request, 'Bookmark already exists')
+    return redirect(request.get_full_path())
 
 
 class ReadBookView(LoginRequiredMixin, DetailView):
@@ -153,39 +261,192 @@ class ReadBookView(LoginRequiredMixin, DetailView):
     """
     model = Book
     template_name = 'read_book.html'
-    slug_field = 'title'
-    slug_url_kwarg = 'title'
 
     def get_context_data(self, **kwargs):
         """
         Builds context needed to obtain needed information to display.
+        The page is shown with the render profile given in the profile query parameter, unknown profiles
+        fall back to the default one.
+        In the text mode the stored HTML of the page text is shown instead, unless the page is mostly images.
 
         :param kwargs: retrieves context built by DetailView and retrieves kwargs from URL.
         :return: Context dictionary
         """
         context = super().get_context_data(**kwargs)
-        context['page_number'] = self.kwargs['page_number']
-        context['next'], context['previous'] = self.kwargs['page_number']+1, self.kwargs['page_number']-1
-        context['page_image'] = decode_image_data(get_pdf_data(self.object.pdf), context['page_number']-1)
+        profile, mode = get_reader_options(self.request.GET)
+        context.update(get_reader_context(self.object, self.kwargs['page_number'], profile, mode))
+        if mode == 'text':
+            page_text = PageText.objects.filter(book=self.object, page=context['page_number'],
+                                                image_heavy=False).only('html').first()
+            context['page_html'] = page_text.html if page_text else None
         update_reading_progress(self.request.user, self.object, context['page_number'])
+        if not context.get('page_html'):
+            context['page_version'] = get_page_version(self.object, profile)
         return context
 
-    def post(self, request, title: str, page_number: int):
+    def post(self, request, pk: int, page_number: int):
+        """
+        Handles the POST request for creating new bookmarks.
+        The current page is bookmarked, or every page listed in the 'pages' field.
+
+        :param request: The incoming request object.
+        :param pk: The primary key of the book. Retrieved from the URL.
+        :param page_number: The page number of the book. Retrieved from the URL.
+        :return: A redirect response back to the page, keeping the render profile.
+        """
+        return bookmark_pages(request, get_object_or_404(Book, pk=pk), page_number)
+
+
+class AsyncReadBookView(View):
+    """
+    Async version of ReadBookView for ASGI deployments, routed instead of it when READER_ASYNC is set.
+    The book, the page text and the progress row are fetched with the async ORM and the page image is
+    rendered by AsyncPageImageView, so waiting readers don't hold a worker thread.
+    Templates and bookmarks still run sync code and are handed to a thread.
+    """
+    template_name = 'read_book.html'
+
+    @staticmethod
+    async def get_book(request, pk):
+        """
+        Resolves the user outside the event loop and fetches the book.
+
+        :return: Book object, or None if the user is not logged in
         """
-        Handles the POST request for creating a new bookmark.
+        if not await sync_to_async(lambda: request.user.is_authenticated)():
+            return None
+        try:
+            return await Book.objects.aget(pk=pk)
+        except Book.DoesNotExist:
+            raise Http404('Book does not exist')
+
+    async def get(self, request, pk: int, page_number: int):
+        """
+        Handles the GET request for reading a page, see ReadBookView.get_context_data.
 
         :param request: The incoming request object.
-        :param title: The title of the book. Retrieved from the URL.
+        :param pk: The primary key of the book. Retrieved from the URL.
         :param page_number: The page number of the book. Retrieved from the URL.
-        :return: A redirect response.
-        """
-        book = get_object_or_404(Book, title=title)
-        if 'bookmark' in request.POST:
-            existing_bookmark = Bookmark.objects.filter(book=book, user=request.user, page=page_number)
-            if existing_bookmark.exists():
-                messages.warning(self.request, 'Bookmark already exists')
-            else:
-                bookmark = Bookmark.objects.create(book=book, user=request.user, page=page_number)
-                bookmark.save()
-                messages.success(self.request, 'Bookmark submission successful')
-            return redirect('webble:read_book', title=book.title, page_number=page_number)
+        :return: A rendered response with the page.
+        """
+        book = await self.get_book(request, pk)
+        if book is None:
+            return redirect_to_login(request.get_full_path())
+        profile, mode = get_reader_options(request.GET)
+        context = get_reader_context(book, page_number, profile, mode)
+        if mode == 'text':
+            page_text = await PageText.objects.filter(book=book, page=page_number,
+                                                      image_heavy=False).only('html').afirst()
+            context['page_html'] = page_text.html if page_text else None
+        await aupdate_reading_progress(request.user, book, page_number)
+        if not context.get('page_html'):
+            context['page_version'] = get_page_version(book, profile)
+        return await sync_to_async(render)(request, self.template_name, context)
+
+    async def post(self, request, pk: int, page_number: int):
+        """
+        Handles the POST request for creating new bookmarks, see ReadBookView.post.
+        """
+        book = await self.get_book(request, pk)
+        if book is None:
+            return redirect_to_login(request.get_full_path())
+        return await sync_to_async(bookmark_pages)(request, book, page_number)
+
+
+class PageImageView(View):
+    """
+    This view is responsible for serving a rendered page of a book as an image.
+    Responses carry ETag/Last-Modified validators and long-lived Cache-Control headers,
+    so browsers and reverse proxies can keep the pages instead of asking for them again.
+    Only the render profiles in PAGE_RENDER_PROFILES are accepted, keeping the number of cached variants bounded.
+    Once the page is served, the following pages are prefetched, so they never compete with it for the document.
+    """
+
+    def get(self, request, pk: int, page_number: int):
+        """
+        Handles the GET request for a page image.
+
+        :param request: The incoming request object.
+        :param pk: The primary key of the book. Retrieved from the URL.
+        :param page_number: The page number of the book. Retrieved from the URL.
+        :return: Image response, or 304 response if the client copy is still valid.
+        """
+        profile = self.get_profile(request)
+        book = self.check_page(get_object_or_404(Book, pk=pk), page_number)
+        etag, last_modified = self.get_validators(book, page_number, profile)
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = self.image_response(get_page_image(book, page_number-1, profile), profile)
+        page_prefetcher.schedule(book, page_number-1, profile)
+        return self.finalize(response, etag, last_modified)
+
+    @staticmethod
+    def get_profile(request):
+        profile = request.GET.get('profile', settings.PAGE_DEFAULT_PROFILE)
+        if profile not in settings.PAGE_RENDER_PROFILES:
+            raise Http404('Render profile does not exist')
+        return profile
+
+    @staticmethod
+    def check_page(book, page_number):
+        if page_number < 1 or (book.page_count and page_number > book.page_count):
+            raise Http404('Page does not exist')
+        return book
+
+    @staticmethod
+    def get_validators(book, page_number, profile):
+        """
+        Builds the ETag and the Last-Modified timestamp of a page image.
+
+        :return: Tuple of the quoted ETag and the timestamp
+        :raises Http404: If the PDF of the book is missing
+        """
+        etag = quote_etag(f'{get_page_version(book, profile)}-{page_number}')
+        try:
+            return etag, book.pdf.storage.get_modified_time(book.pdf.name).timestamp()
+        except OSError:
+            raise Http404('Book file does not exist')
+
+    @staticmethod
+    def image_response(image_data, profile):
+        content_type = RENDER_FORMATS[settings.PAGE_RENDER_PROFILES[profile]['format']][1]
+        return HttpResponse(image_data, content_type=content_type)
+
+    @staticmethod
+    def finalize(response, etag, last_modified):
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        patch_cache_control(response, public=True, max_age=settings.PAGE_IMAGE_MAX_AGE)
+        return response
+
+
+class AsyncPageImageView(PageImageView):
+    """
+    Async version of PageImageView for ASGI deployments, routed instead of it when READER_ASYNC is set.
+    Pages are rendered on the bounded render executor, when it is full the request is refused
+    with 503 and Retry-After instead of queueing more rendering work.
+    """
+
+    async def get(self, request, pk: int, page_number: int):
+        """
+        Handles the GET request for a page image, see PageImageView.get.
+        """
+        profile = self.get_profile(request)
+        try:
+            book = self.check_page(await Book.objects.aget(pk=pk), page_number)
+        except Book.DoesNotExist:
+            raise Http404('Book does not exist')
+        # The modification time is read from the storage, which may be a blocking call
+        etag, last_modified = await sync_to_async(self.get_validators, thread_sensitive=False)(
+            book, page_number, profile)
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            try:
+                image_data = await render_executor.run(get_page_image, book, page_number-1, profile)
+            except RenderQueueFull:
+                response = HttpResponse('Too many pages are being rendered', status=503)
+                response['Retry-After'] = '1'
+                return response
+            response = self.image_response(image_data, profile)
+        page_prefetcher.schedule(book, page_number-1, profile)
+        return self.finalize(response, etag, last_modified)